@@ -0,0 +1,135 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+SHARED_KEY = 'auth:token:{}'
+
+
+def _digest(key):
+    # В общем кэше токены хранятся только в виде хэша
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def snapshot(token):
+    '''Токен с пользователем в виде значений полей. Объекты
+    моделей в кэше делили бы одного User между запросами'''
+    user = token.user
+    return (token.user_id, token.created, user._state.db, {
+        field.attname: getattr(user, field.attname)
+        for field in user._meta.concrete_fields})
+
+
+def restore(model, key, entry):
+    '''Новые объекты токена и пользователя для одного запроса'''
+    user_id, created, db, values = entry
+    user = get_user_model().from_db(db, list(values), list(values.values()))
+    token = model(key=key, user_id=user_id, created=created)
+    token.user = user
+    return token
+
+
+class TokenCache:
+    '''LRU-кэш токен -> (user_id, created, db, поля пользователя)
+    в памяти процесса'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (
+                time.monotonic() + cache_ttl(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def discard(self, key=None, user_id=None):
+        with self.lock:
+            if key is not None:
+                self.entries.pop(key, None)
+            if user_id is not None:
+                for cached_key in [
+                        cached_key for cached_key, (_, value)
+                        in self.entries.items()
+                        if value[0] == user_id]:
+                    del self.entries[cached_key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def cache_ttl():
+    # Запись может пройти через общий кэш и затем через локальный,
+    # поэтому каждому достаётся половина окна отзыва
+    return settings.TOKEN_REVOCATION_WINDOW / 2
+
+
+def shared_cache():
+    alias = settings.TOKEN_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def forget_token(key, user_id=None):
+    '''Вызывается при выходе и смене пароля. В этом процессе
+    токен перестаёт действовать сразу, в остальных — не позже
+    чем через TOKEN_REVOCATION_WINDOW секунд'''
+    token_cache.discard(key=key, user_id=user_id)
+    cache = shared_cache()
+    if cache is not None:
+        cache.delete(SHARED_KEY.format(_digest(key)))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''TokenAuthentication без запроса к БД на каждый вызов API'''
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            entry = self.load_token(key)
+            token_cache.set(key, entry)
+        token = restore(self.get_model(), key, entry)
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return (token.user, token)
+
+    def load_token(self, key):
+        cache = shared_cache()
+        shared_key = SHARED_KEY.format(_digest(key))
+        if cache is not None:
+            entry = cache.get(shared_key)
+            if entry is not None:
+                return entry
+        model = self.get_model()
+        try:
+            entry = snapshot(model.objects.select_related('user').get(key=key))
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if cache is not None:
+            cache.set(shared_key, entry, int(cache_ttl()) or 1)
+        return entry
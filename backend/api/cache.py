@@ -0,0 +1,168 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+from django.utils.http import quote_etag
+
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from recipe.catalog import catalog_delta, catalog_version
+
+VERSION_KEY = 'api:{}:version'
+RESPONSE_KEY = 'api:{}:{}:{}'
+
+
+def _version_timeout():
+    # В локальном кэше процесса версия живёт недолго: другие
+    # воркеры не видят invalidate и иначе отдавали бы старые ответы
+    return settings.API_CACHE_VERSION_TIMEOUT or None
+
+
+def namespace_version(namespace):
+    '''Версия пространства имён в ключах кэша. Это время
+    последнего сброса в этом процессе, а не изменения данных,
+    поэтому в Last-Modified она не отдаётся'''
+    version = cache.get(VERSION_KEY.format(namespace))
+    if version is None:
+        version = int(time.time())
+        cache.add(VERSION_KEY.format(namespace), version, _version_timeout())
+    return version
+
+
+def invalidate(*namespaces):
+    '''Сбрасывает закэшированные ответы пространств имён.
+    Внутри транзакции вызывается через transaction.on_commit'''
+    version = int(time.time())
+    for namespace in namespaces:
+        key = VERSION_KEY.format(namespace)
+        # Версия должна меняться даже при нескольких
+        # изменениях за одну секунду
+        current = cache.get(key)
+        cache.set(key, max(version, (current or 0) + 1), _version_timeout())
+
+
+def _request_key(request):
+    params = sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in values)
+    raw = json.dumps([request.path, params])
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def _make_etag(data):
+    raw = json.dumps(data, sort_keys=True, default=str)
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def _weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def _not_modified(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is None:
+        return False
+    # Слабое сравнение (RFC 7232): сжатый ответ
+    # приходит клиенту со слабым W/-вариантом ETag
+    return _weak(etag) in (
+        _weak(tag.strip()) for tag in if_none_match.split(','))
+
+
+class CachedResponseMixin:
+    '''Кэширует ответы list/retrieve и отвечает 304
+    на условные запросы с ETag'''
+    cache_namespace = None
+    cache_actions = ('list', 'retrieve')
+
+    def is_cacheable(self, request):
+        return (self.action in self.cache_actions
+                and request.method == 'GET')
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+        version = namespace_version(self.cache_namespace)
+        etag = self.version_etag(request)
+        if etag is not None and _not_modified(request, etag):
+            # Ответ не нужен ни из БД, ни из кэша
+            return self.not_modified(etag)
+        # ETag версии справочника прочитан из БД: в ключе он
+        # защищает от устаревшей версии пространства в кэше воркера
+        key = RESPONSE_KEY.format(
+            self.cache_namespace, etag or version, _request_key(request))
+        entry = cache.get(key)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry = (response.data, etag or _make_etag(response.data))
+            cache.set(key, entry, settings.API_CACHE_TIMEOUT)
+        data, etag = entry
+        if _not_modified(request, etag):
+            return self.not_modified(etag)
+        response = Response(data)
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def version_etag(self, request):
+        '''ETag без построения ответа; None — по содержимому'''
+        return None
+
+    def etag_response(self, request, etag, build):
+        '''Ответ с заранее известным ETag, без кэширования данных:
+        304 при совпадении с If-None-Match, иначе build()'''
+        if _not_modified(request, etag):
+            return self.not_modified(etag)
+        response = Response(build())
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def not_modified(self, etag):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+
+class CatalogCacheMixin(CachedResponseMixin):
+    '''Справочник с версией: сильный ETag из номера версии
+    и синхронизация изменений через /delta/?since=<версия>'''
+
+    def version_etag(self, request, version=None):
+        if version is None:
+            version = catalog_version(self.cache_namespace)
+        return quote_etag('{}-{}-{}'.format(
+            self.cache_namespace, version, _request_key(request)[:16]))
+
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def delta(self, request):
+        since = request.query_params.get('since', '0')
+        if not since.isdigit():
+            raise ValidationError(
+                {'since': 'Версия должна быть целым числом'})
+        version = catalog_version(self.cache_namespace)
+        etag = quote_etag(
+            f'{self.cache_namespace}-{version}-since-{int(since)}')
+        if _not_modified(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(
+                catalog_delta(self.cache_namespace, int(since)))
+        response['ETag'] = etag
+        return response
@@ -0,0 +1,86 @@
+import re
+from gzip import GzipFile
+from io import BytesIO
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Картинки, PDF и архивы уже сжаты: повторное сжатие только тратит CPU
+COMPRESSIBLE_TYPES = re.compile(
+    r'^(text/|application/(json|javascript|xml)$|application/.+\+(json|xml)$)')
+
+
+def accepted_encodings(header):
+    '''Accept-Encoding: gzip;q=0.8, br -> {'gzip': 0.8, 'br': 1.0}'''
+    encodings = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q=([\d.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        if coding:
+            encodings[coding.strip().lower()] = quality
+    return encodings
+
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header)
+    available = ('br', 'gzip') if brotli is not None else ('gzip',)
+    best = max(available,
+               key=lambda coding: accepted.get(coding, accepted.get('*', 0)))
+    if accepted.get(best, accepted.get('*', 0)) <= 0:
+        return None
+    return best
+
+
+def compress(content, coding):
+    if coding == 'br':
+        return brotli.compress(
+            content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    buffer = BytesIO()
+    with GzipFile(mode='wb', fileobj=buffer, mtime=0,
+                  compresslevel=settings.COMPRESSION_GZIP_LEVEL) as file:
+        file.write(content)
+    return buffer.getvalue()
+
+
+class CompressionMiddleware:
+    '''Сжатие brotli или gzip ответов API от COMPRESSION_MIN_BYTES.
+    Потоковые выгрузки и уже сжатые форматы не трогает'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0]
+        if (not COMPRESSIBLE_TYPES.match(content_type.strip().lower())
+                or len(response.content) < settings.COMPRESSION_MIN_BYTES):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+        compressed = compress(response.content, coding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = coding
+        # Сильный ETag обещает побайтно тот же ответ: как и в
+        # GZipMiddleware, после сжатия он становится слабым
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
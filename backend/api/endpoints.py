@@ -0,0 +1,85 @@
+from urllib.parse import urlencode
+
+from django.urls import reverse
+
+from recipe.models import Favorite, Ingredient, Recipe, ShoppingСart, Tag
+from users.models import Subscribe, User
+
+
+def _url(url_name, *args, **params):
+    url = reverse(url_name, args=args)
+    if params:
+        url += '?' + urlencode(params)
+    return url
+
+
+def api_requests(user):
+    '''Типовые запросы к API от имени user на заполненной базе:
+    (название, метод, адрес). Используются проверкой планов
+    запросов и нагрузочными замерами'''
+    recipe = Recipe.objects.exclude(author=user).first()
+    tag = Tag.objects.first()
+    ingredient = Ingredient.objects.first()
+    author = recipe.author
+    new_favorite = Recipe.objects.exclude(
+        pk__in=Favorite.objects.filter(user=user).values('recipe')).first()
+    new_in_cart = Recipe.objects.exclude(
+        pk__in=ShoppingСart.objects.filter(user=user).values(
+            'recipe')).first()
+    new_author = User.objects.exclude(pk=user.pk).exclude(
+        pk__in=Subscribe.objects.filter(user=user).values('author')).first()
+
+    requests = [
+        ('users-list', 'get', _url('users-list')),
+        ('users-detail', 'get', _url('users-detail', author.pk)),
+        ('users-me', 'get', _url('users-me')),
+        ('users-subscriptions', 'get',
+         _url('users-subscriptions', recipes_limit=3)),
+        ('users-subscriptions-cursor', 'get',
+         _url('users-subscriptions', cursor='', recipes_limit=3)),
+        ('tags-list', 'get', _url('tags-list')),
+        ('tags-detail', 'get', _url('tags-detail', tag.pk)),
+        ('ingredients-list', 'get', _url('ingredients-list')),
+        ('ingredients-search', 'get',
+         _url('ingredients-list', name=ingredient.name[:2])),
+        ('ingredients-detail', 'get',
+         _url('ingredients-detail', ingredient.pk)),
+        ('recipes-list', 'get', _url('recipes-list')),
+        ('recipes-list-cursor', 'get', _url('recipes-list', cursor='')),
+        ('recipes-list-cards', 'get',
+         _url('recipes-list', fields='id,name,image,cooking_time')),
+        ('recipes-list-tags', 'get', _url('recipes-list', tags=tag.slug)),
+        ('recipes-list-author', 'get',
+         _url('recipes-list', author=author.pk)),
+        ('recipes-list-favorited', 'get',
+         _url('recipes-list', is_favorited=1)),
+        ('recipes-list-in-cart', 'get',
+         _url('recipes-list', is_in_shopping_cart=1)),
+        ('recipes-search', 'get',
+         _url('recipes-list', search=recipe.name.split()[0])),
+        ('recipes-detail', 'get', _url('recipes-detail', recipe.pk)),
+        ('recipes-download-shopping-cart', 'get',
+         _url('recipes-download-shopping-cart')),
+    ]
+    if new_favorite is not None:
+        requests += [
+            ('recipes-favorite-add', 'post',
+             _url('recipes-favorite', new_favorite.pk)),
+            ('recipes-favorite-remove', 'delete',
+             _url('recipes-favorite', new_favorite.pk)),
+        ]
+    if new_in_cart is not None:
+        requests += [
+            ('recipes-shopping-cart-add', 'post',
+             _url('recipes-shopping-cart', new_in_cart.pk)),
+            ('recipes-shopping-cart-remove', 'delete',
+             _url('recipes-shopping-cart', new_in_cart.pk)),
+        ]
+    if new_author is not None:
+        requests += [
+            ('users-subscribe', 'post',
+             _url('users-subscribe', new_author.pk)),
+            ('users-unsubscribe', 'delete',
+             _url('users-subscribe', new_author.pk)),
+        ]
+    return requests
@@ -0,0 +1,133 @@
+import csv
+import os
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+
+from recipe.models import ShoppingCartIngredient
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+EXPORT_CHUNK_SIZE = 500
+PDF_SPOOL_SIZE = 2 * 1024 * 1024
+PDF_READ_SIZE = 64 * 1024
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+
+
+def shopping_list_items(user):
+    '''Суммарное количество ингредиентов из корзины пользователя'''
+    return (
+        ShoppingCartIngredient.objects
+        .filter(user=user)
+        .values_list('ingredient__name', 'amount',
+                     'ingredient__measurement_unit')
+        .order_by('ingredient__name')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def _chunked(lines):
+    '''Склеивает строки в пачки, чтобы не писать в сокет по строке'''
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _txt_lines(items, current_date):
+    yield f'Дата: {current_date.strftime("%d/%m/%Y")}\n'
+    for number, item in enumerate(items, start=1):
+        yield '{}. {} - {} {}.\n'.format(number, *item)
+
+
+def export_txt(items, current_date):
+    return _chunked(_txt_lines(items, current_date))
+
+
+class _Echo:
+    '''Буфер для csv.writer, возвращающий записанную строку'''
+    def write(self, value):
+        return value
+
+
+def _csv_lines(items):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for item in items:
+        yield writer.writerow(item)
+
+
+def export_csv(items, current_date):
+    return _chunked(_csv_lines(items))
+
+
+def _register_pdf_font():
+    font_path = settings.SHOPPING_LIST_PDF_FONT
+    if PDF_FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return PDF_FONT_NAME
+    if font_path and os.path.exists(font_path):
+        pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, font_path))
+        return PDF_FONT_NAME
+    return 'Helvetica'
+
+
+def export_pdf(items, current_date):
+    '''PDF рисуется постранично во временный файл, который
+    при большом размере уходит на диск, и отдаётся частями'''
+    buffer = SpooledTemporaryFile(max_size=PDF_SPOOL_SIZE)
+    font = _register_pdf_font()
+    document = canvas.Canvas(buffer, pagesize=A4)
+    _, height = A4
+    line_height = PDF_FONT_SIZE * 1.5
+    lines = _txt_lines(items, current_date)
+    line = next(lines, None)
+    while line is not None:
+        document.setFont(font, PDF_FONT_SIZE)
+        y = height - PDF_MARGIN
+        while line is not None and y > PDF_MARGIN:
+            document.drawString(PDF_MARGIN, y, line.rstrip('\n'))
+            y -= line_height
+            line = next(lines, None)
+        document.showPage()
+    document.save()
+    buffer.seek(0)
+    try:
+        yield from iter(lambda: buffer.read(PDF_READ_SIZE), b'')
+    finally:
+        buffer.close()
+
+
+def spool(chunks):
+    '''Собирает выгрузку во временный файл. Под ASGI Django 3.2
+    перебирает потоковый ответ в цикле событий, где запросы к БД
+    запрещены, поэтому выгрузка формируется заранее, в потоке view'''
+    buffer = SpooledTemporaryFile(max_size=PDF_SPOOL_SIZE)
+    for chunk in chunks:
+        buffer.write(chunk.encode() if isinstance(chunk, str) else chunk)
+    buffer.seek(0)
+    return buffer
+
+
+EXPORT_FORMATS = {
+    'txt': (export_txt, 'text/plain; charset=utf-8'),
+    'csv': (export_csv, 'text/csv; charset=utf-8'),
+    'pdf': (export_pdf, 'application/pdf'),
+}
+
+
+def available_formats():
+    if canvas is None:
+        return [name for name in EXPORT_FORMATS if name != 'pdf']
+    return list(EXPORT_FORMATS)
@@ -0,0 +1,94 @@
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+class SparseFieldsetSerializerMixin:
+    '''Выводит только поля из fields. Связи, которых нет
+    в expand, выводятся идентификаторами (см. collapsed_fields).
+    None в fields или expand — как без параметра'''
+    # Поле -> фабрика компактной замены
+    collapsed_fields = {}
+    # Поле -> фабрика поля, которое выводится только по ?expand=
+    expandable_fields = {}
+    # Поле -> колонки модели для only(); по умолчанию само поле
+    sparse_columns = {}
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        if expand is not None:
+            for name, make_field in self.collapsed_fields.items():
+                if name in self.fields and name not in expand:
+                    self.fields[name] = make_field()
+            for name, make_field in self.expandable_fields.items():
+                if name in expand:
+                    self.fields[name] = make_field()
+
+
+class SparseFieldsetMixin:
+    '''?fields=id,name,image и ?expand=author для ViewSet:
+    в ответ попадают только нужные поля, а запрос к БД читает
+    только их колонки'''
+    sparse_actions = ('list', 'retrieve')
+    # Колонки, без которых не обойтись: ключ, сортировка курсора
+    required_columns = ('id',)
+
+    def _parse(self, param, allowed):
+        value = self.request.query_params.get(param)
+        if value is None:
+            return None
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = sorted(set(names) - set(allowed))
+        if unknown:
+            raise ValidationError({param: (
+                f'Неизвестные поля: {", ".join(unknown)}. '
+                f'Доступны: {", ".join(allowed) or "нет"}')})
+        return names
+
+    def sparse_fieldset(self):
+        '''(fields, expand) из запроса; None — параметра нет'''
+        if self.action not in self.sparse_actions:
+            return None, None
+        if not hasattr(self, '_sparse_fieldset'):
+            serializer_class = self.get_serializer_class()
+            fields = self._parse(FIELDS_PARAM, serializer_class.Meta.fields)
+            expand = self._parse(
+                EXPAND_PARAM, (*serializer_class.collapsed_fields,
+                               *serializer_class.expandable_fields))
+            self._sparse_fieldset = (fields or None, expand)
+        return self._sparse_fieldset
+
+    def is_requested(self, name):
+        fields, _ = self.sparse_fieldset()
+        return fields is None or name in fields
+
+    def is_expanded(self, name):
+        fields, expand = self.sparse_fieldset()
+        expandable = getattr(
+            self.get_serializer_class(), 'expandable_fields', {})
+        if name in expandable:
+            return expand is not None and name in expand
+        return self.is_requested(name) and (expand is None or name in expand)
+
+    def sparse_queryset(self, queryset):
+        '''only() по колонкам запрошенных полей'''
+        fields, _ = self.sparse_fieldset()
+        if fields is None:
+            return queryset
+        columns = self.get_serializer_class().sparse_columns
+        only = set(self.required_columns)
+        for name in fields:
+            only.update(columns.get(name, (name,)))
+        return queryset.only(*only)
+
+    def get_serializer(self, *args, **kwargs):
+        fields, expand = self.sparse_fieldset()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        if expand is not None:
+            kwargs.setdefault('expand', expand)
+        return super().get_serializer(*args, **kwargs)
@@ -1,6 +1,7 @@
 from django_filters.rest_framework import FilterSet, filters
 
 from recipe.models import Ingredient, Recipe, Tag
+from .search import search_recipes
 
 
 class IngredientFilter(FilterSet):
@@ -22,6 +23,8 @@ class RecipeFilter(FilterSet):
         method='is_favorited_filter')
     is_in_shopping_cart = filters.BooleanFilter(
         method='is_in_shopping_cart_filter')
+    search = filters.CharFilter(method='search_filter')
+    popular = filters.BooleanFilter(method='popular_filter')
 
     class Meta:
         model = Recipe
@@ -37,4 +40,14 @@ class RecipeFilter(FilterSet):
         user = self.request.user
         if value and user.is_authenticated:
             return queryset.filter(shopping_cart_recipe__user=user)
-        return queryset
\ No newline at end of file
+        return queryset
+
+    def popular_filter(self, queryset, name, value):
+        if value:
+            return queryset.order_by('-favorites_count', '-pub_date', '-id')
+        return queryset
+
+    def search_filter(self, queryset, name, value):
+        if value.strip():
+            return search_recipes(queryset, value)
+        return queryset
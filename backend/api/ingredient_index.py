@@ -0,0 +1,73 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from recipe.catalog import catalog_version
+from recipe.models import Ingredient
+
+
+def normalize(value):
+    '''Регистр не учитывается, «ё» приравнивается к «е»'''
+    return value.strip().casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    '''Отсортированный в памяти процесса список ингредиентов
+    для поиска по началу названия без обращения к БД'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._rows = []
+        self._version = None
+        self._loaded_at = 0
+
+    def _is_stale(self, version):
+        return (version != self._version
+                or time.monotonic() - self._loaded_at
+                > settings.INGREDIENT_INDEX_MAX_AGE)
+
+    def _load(self, version):
+        entries = sorted(
+            ((normalize(name), {'id': pk, 'name': name,
+                                'measurement_unit': measurement_unit})
+             for pk, name, measurement_unit
+             in Ingredient.objects.values_list(
+                 'id', 'name', 'measurement_unit').iterator()),
+            key=lambda entry: (entry[0], entry[1]['id']))
+        keys = [key for key, _ in entries]
+        rows = [row for _, row in entries]
+        self._keys, self._rows = keys, rows
+        self._version = version
+        self._loaded_at = time.monotonic()
+
+    def refresh(self, version=None):
+        '''Перечитывает индекс, если версия справочника в БД
+        сменилась. Версия кэша API для этого не годится: она своя
+        у каждого воркера и не знает об изменениях в других'''
+        if version is None:
+            version = catalog_version('ingredients')
+        if self._is_stale(version):
+            with self._lock:
+                if self._is_stale(version):
+                    self._load(version)
+
+    def search(self, prefix, limit=None, version=None):
+        '''Top-K ингредиентов, название которых начинается с prefix:
+        сначала точные совпадения, затем более короткие названия'''
+        self.refresh(version)
+        keys, rows = self._keys, self._rows
+        prefix = normalize(prefix)
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\U0010ffff', lo=start)
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        ranked = heapq.nsmallest(
+            limit, range(start, end),
+            key=lambda i: (keys[i] != prefix, len(keys[i]), keys[i]))
+        return [rows[i] for i in ranked]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,167 @@
+import json
+import time
+from statistics import mean
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.endpoints import api_requests
+from api.profiling import SerializerTimer, SqlLog
+from recipe.models import Favorite, Ingredient, Recipe, ShoppingСart, Tag
+from users.models import Subscribe, User
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def response_size(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+class Command(BaseCommand):
+    help = ('Measure latency percentiles, SQL and serialization time, '
+            'query counts and payload sizes of every API route and write '
+            'a JSON report.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--user', help='Email of the requesting user.')
+        parser.add_argument('--output', default='bench_report.json')
+        parser.add_argument(
+            '--cold-cache', action='store_true',
+            help='Clear the response cache before every request.')
+        parser.add_argument(
+            '--baseline',
+            help='Previous report to compare with; the command fails '
+                 'on regressions.')
+        parser.add_argument(
+            '--max-slowdown', type=float, default=0.25,
+            help='Allowed relative growth of p50 latency against '
+                 'the baseline.')
+
+    def dataset(self):
+        return {
+            'users': User.objects.count(),
+            'recipes': Recipe.objects.count(),
+            'tags': Tag.objects.count(),
+            'ingredients': Ingredient.objects.count(),
+            'favorites': Favorite.objects.count(),
+            'carts': ShoppingСart.objects.count(),
+            'subscriptions': Subscribe.objects.count(),
+        }
+
+    def run_round(self, client, requests, cold_cache, measurements):
+        # Добавление и удаление идут парами, поэтому после каждого
+        # круга данные возвращаются в исходное состояние
+        for name, method, path in requests:
+            if cold_cache:
+                cache.clear()
+            sql_log = SqlLog()
+            with connection.execute_wrapper(sql_log), \
+                    SerializerTimer() as serializer_timer:
+                started = time.perf_counter()
+                response = getattr(client, method)(path)
+                size = response_size(response)
+                elapsed = time.perf_counter() - started
+            if measurements is None:
+                continue
+            result = measurements.setdefault(name, {
+                'method': method.upper(), 'path': path, 'timings': [],
+                'sql': [], 'serialize': [], 'queries': [],
+                'status': response.status_code, 'bytes': size})
+            result['timings'].append(elapsed * 1000)
+            result['sql'].append(
+                sum(duration for duration, _, _ in sql_log.queries) * 1000)
+            result['serialize'].append(serializer_timer.elapsed * 1000)
+            result['queries'].append(len(sql_log.queries))
+
+    def summarize(self, measurements):
+        report = {}
+        for name, result in measurements.items():
+            timings = result.pop('timings')
+            sql = result.pop('sql')
+            serialize = result.pop('serialize')
+            queries = result.pop('queries')
+            report[name] = dict(
+                result,
+                mean_ms=round(mean(timings), 3),
+                p50_ms=round(percentile(timings, 0.5), 3),
+                p90_ms=round(percentile(timings, 0.9), 3),
+                p99_ms=round(percentile(timings, 0.99), 3),
+                # Доли запроса: SQL и построение serializer.data
+                sql_p50_ms=round(percentile(sql, 0.5), 3),
+                serialize_p50_ms=round(percentile(serialize, 0.5), 3),
+                queries=max(queries))
+        return report
+
+    def compare(self, report, baseline_path, max_slowdown):
+        with open(baseline_path, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)['routes']
+        regressions = []
+        for name, result in report.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            slowdown = result['p50_ms'] / max(before['p50_ms'], 1e-6) - 1
+            line = (f'{name:<35} p50 {before["p50_ms"]:>8.2f} -> '
+                    f'{result["p50_ms"]:>8.2f} ms ({slowdown:+.0%})  '
+                    f'queries {before["queries"]} -> {result["queries"]}')
+            if (slowdown > max_slowdown
+                    or result['queries'] > before['queries']):
+                regressions.append(name)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        return regressions
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = User.objects.get(email=options['user'])
+        else:
+            user = (User.objects.filter(shopping_cart__isnull=False).first()
+                    or User.objects.first())
+        if user is None or not Recipe.objects.exclude(author=user).exists():
+            raise CommandError('Not enough data, run seed_data first.')
+        client = APIClient()
+        client.force_authenticate(user)
+        requests = api_requests(user)
+
+        for _ in range(options['warmup']):
+            self.run_round(client, requests, options['cold_cache'], None)
+        measurements = {}
+        for _ in range(options['repeat']):
+            self.run_round(
+                client, requests, options['cold_cache'], measurements)
+        report = self.summarize(measurements)
+
+        for name, result in report.items():
+            self.stdout.write(
+                '{:<35} {status} p50 {p50_ms:>8.2f} ms  p90 {p90_ms:>8.2f} '
+                'ms  p99 {p99_ms:>8.2f} ms  sql {sql_p50_ms:>7.2f} ms  '
+                'serialize {serialize_p50_ms:>7.2f} ms  {queries:>3} '
+                'queries  {bytes:>8} B'.format(name, **result))
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump({
+                'created': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'cold_cache': options['cold_cache'],
+                'dataset': self.dataset(),
+                'routes': report,
+            }, output, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Report written to {options["output"]}')
+
+        if options['baseline']:
+            regressions = self.compare(
+                report, options['baseline'], options['max_slowdown'])
+            if regressions:
+                raise CommandError(
+                    'Regressions against the baseline: '
+                    + ', '.join(regressions))
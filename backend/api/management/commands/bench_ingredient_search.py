@@ -0,0 +1,74 @@
+import time
+from statistics import mean, median
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.ingredient_index import ingredient_index, normalize
+from recipe.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = ('Compare ingredient autocomplete served by the in-memory '
+            'index with the name__istartswith ORM query.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix-length', type=int, default=3,
+                            help='Longest prefix typed by the user.')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def prefixes(self, max_length):
+        '''Все начала названий длиной до max_length, как при наборе'''
+        names = Ingredient.objects.values_list('name', flat=True)
+        return sorted({name[:length] for name in names
+                       for length in range(1, max_length + 1)
+                       if len(name) >= length})
+
+    def measure(self, search, prefixes, repeat):
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(repeat):
+                for prefix in prefixes:
+                    started = time.perf_counter()
+                    search(prefix)
+                    timings.append(time.perf_counter() - started)
+        timings.sort()
+        return {
+            'mean_ms': mean(timings) * 1000,
+            'median_ms': median(timings) * 1000,
+            'p95_ms': timings[int(len(timings) * 0.95)] * 1000,
+            'queries': len(queries),
+        }
+
+    def handle(self, *args, **options):
+        prefixes = self.prefixes(options['prefix_length'])
+        if not prefixes:
+            self.stderr.write(
+                'No ingredients loaded, run import_ingredients first.')
+            return
+        ingredient_index.refresh()
+        results = {
+            'orm': self.measure(
+                lambda prefix: list(Ingredient.objects.filter(
+                    name__istartswith=prefix).values()),
+                prefixes, options['repeat']),
+            'index': self.measure(
+                lambda prefix: ingredient_index.search(prefix),
+                prefixes, options['repeat']),
+        }
+        self.stdout.write(
+            f'{len(prefixes)} prefixes, {options["repeat"]} rounds')
+        for name, result in results.items():
+            self.stdout.write(
+                '{:<6} mean {mean_ms:.3f} ms  median {median_ms:.3f} ms  '
+                'p95 {p95_ms:.3f} ms  queries {queries}'.format(
+                    name, **result))
+        # Проверка, что индекс находит то же, что и БД без учёта регистра
+        missed = sum(
+            1 for prefix in prefixes
+            if len(ingredient_index.search(prefix, limit=10 ** 6))
+            != sum(1 for name in Ingredient.objects.values_list(
+                'name', flat=True)
+                if normalize(name).startswith(normalize(prefix))))
+        self.stdout.write(f'prefixes with mismatched results: {missed}')
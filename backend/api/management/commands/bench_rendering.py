@@ -0,0 +1,100 @@
+import json
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.compression import brotli, compress
+from api.renderers import FastJSONRenderer, orjson
+from api.serializers import RecipeListSerializer
+from recipe.models import Recipe
+from users.models import User
+from .bench_api import percentile
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, timings
+
+
+class Command(BaseCommand):
+    help = ('Measure serialization, JSON encoding and compression cost '
+            'of one recipe list page.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--user', help='Email of the requesting user.')
+        parser.add_argument('--output', help='Write results as JSON.')
+
+    def page_data(self, options):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = self.user(options['user'])
+        recipes = list(Recipe.objects.with_related().order_by(
+            '-pub_date', '-id')[:options['page_size']])
+        if not recipes:
+            raise CommandError('No recipes, run seed_data first.')
+
+        def serialize():
+            # Новый запрос на каждый повтор: наборы избранного
+            # и корзины запоминаются в объекте запроса
+            request._user_relations = None
+            return RecipeListSerializer(
+                recipes, many=True,
+                context={'request': request, 'image_rendition': 'card'},
+            ).data
+
+        return timed(serialize, options['repeat'])
+
+    def user(self, email):
+        if not email:
+            return AnonymousUser()
+        user = User.objects.filter(email=email).first()
+        if user is None:
+            raise CommandError(f'User {email} not found.')
+        return user
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        data, serialize_timings = self.page_data(options)
+        stages = [('serialize', None, serialize_timings)]
+        renderers = [('json', JSONRenderer())]
+        if orjson is not None:
+            renderers.append(('orjson', FastJSONRenderer()))
+        else:
+            self.stderr.write('orjson is not installed, skipping it.')
+        encoded = None
+        for name, renderer in renderers:
+            encoded, timings = timed(lambda: renderer.render(data), repeat)
+            stages.append((f'encode:{name}', len(encoded), timings))
+        codings = ['gzip'] + (['br'] if brotli is not None else [])
+        for coding in codings:
+            compressed, timings = timed(
+                lambda: compress(encoded, coding), repeat)
+            stages.append((f'compress:{coding}', len(compressed), timings))
+        results = []
+        self.stdout.write(f'{len(data)} recipes per page, '
+                          f'{repeat} repeats')
+        for stage, size, timings in stages:
+            result = {
+                'stage': stage,
+                'bytes': size,
+                'p50_ms': round(percentile(timings, 0.5), 3),
+                'p99_ms': round(percentile(timings, 0.99), 3),
+            }
+            results.append(result)
+            self.stdout.write(
+                '{stage:<16} p50 {p50_ms:>8} ms  p99 {p99_ms:>8} ms  '
+                '{size}'.format(size=f'{size} bytes' if size else '',
+                                **result))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump({'page_size': len(data), 'repeat': repeat,
+                           'results': results}, output, indent=2)
@@ -0,0 +1,149 @@
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from .bench_api import percentile
+
+MODES = ('sync', 'gthread', 'asgi')
+SLOW_PATH = '/api/auth/token/login/'
+
+
+def slow_client(port, stop, body_size, interval):
+    '''Клиент с медленным каналом: тело запроса уходит по байту,
+    и всё это время запрос держит воркер (или поток) сервера'''
+    while not stop.is_set():
+        try:
+            with socket.create_connection(('127.0.0.1', port)) as sock:
+                sock.sendall(
+                    (f'POST {SLOW_PATH} HTTP/1.1\r\nHost: localhost\r\n'
+                     'Content-Type: application/json\r\n'
+                     f'Content-Length: {body_size}\r\n\r\n').encode())
+                for _ in range(body_size):
+                    if stop.is_set():
+                        return
+                    sock.sendall(b' ')
+                    time.sleep(interval)
+                sock.recv(1024)
+        except OSError:
+            time.sleep(interval)
+
+
+def fast_client(port, path, stop, timings, errors):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection(
+                '127.0.0.1', port, timeout=30)
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            if response.status != 200:
+                raise OSError(response.status)
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            continue
+        timings.append(time.perf_counter() - started)
+
+
+class Command(BaseCommand):
+    help = ('Compare throughput of gunicorn sync, gthread and ASGI '
+            '(uvicorn) workers while slow clients are uploading.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=MODES,
+                            default=list(MODES))
+        parser.add_argument('--path', default='/api/tags/')
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument('--clients', type=int, default=8,
+                            help='Concurrent regular clients.')
+        parser.add_argument('--slow-clients', type=int, default=16)
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--output', help='Write results as JSON.')
+
+    def start_server(self, mode, options):
+        env = dict(
+            os.environ, GUNICORN_WORKER_MODE=mode,
+            GUNICORN_BIND=f'127.0.0.1:{options["port"]}',
+            GUNICORN_WORKERS=str(options['workers']),
+            GUNICORN_THREADS=str(options['threads']),
+            DJANGO_SETTINGS_MODULE=os.environ.get(
+                'DJANGO_SETTINGS_MODULE', 'foodgram.settings'))
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+             '--access-logfile', '/dev/null'],
+            cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'gunicorn ({mode}) exited with code '
+                                   f'{server.returncode}.')
+            try:
+                connection = http.client.HTTPConnection(
+                    '127.0.0.1', options['port'], timeout=2)
+                connection.request('GET', options['path'])
+                connection.getresponse().read()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f'gunicorn ({mode}) did not start.')
+
+    def run_mode(self, mode, options):
+        server = self.start_server(mode, options)
+        stop = threading.Event()
+        timings, errors = [], []
+        threads = [
+            threading.Thread(target=slow_client, daemon=True, args=(
+                options['port'], stop, 64, options['duration'] / 64))
+            for _ in range(options['slow_clients'])]
+        threads += [
+            threading.Thread(target=fast_client, daemon=True, args=(
+                options['port'], options['path'], stop, timings, errors))
+            for _ in range(options['clients'])]
+        try:
+            for thread in threads:
+                thread.start()
+            time.sleep(options['duration'])
+        finally:
+            stop.set()
+            server.terminate()
+            server.wait(timeout=30)
+        for thread in threads:
+            thread.join(timeout=5)
+        timings = [timing * 1000 for timing in timings]
+        return {
+            'mode': mode,
+            'requests': len(timings),
+            'rps': round(len(timings) / options['duration'], 1),
+            'p50_ms': round(percentile(timings, 0.5), 1) if timings else None,
+            'p99_ms': round(percentile(timings, 0.99), 1) if timings else None,
+            'errors': len(errors),
+        }
+
+    def handle(self, *args, **options):
+        results = []
+        for mode in options['modes']:
+            result = self.run_mode(mode, options)
+            results.append(result)
+            self.stdout.write(
+                '{mode:<8} {rps:>8} req/s  p50 {p50_ms} ms  '
+                'p99 {p99_ms} ms  {errors} errors'.format(**result))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump({'options': {
+                    key: options[key] for key in (
+                        'path', 'duration', 'clients', 'slow_clients',
+                        'workers', 'threads')},
+                    'results': results}, output, indent=2)
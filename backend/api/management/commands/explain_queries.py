@@ -0,0 +1,96 @@
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.endpoints import api_requests
+from users.models import User
+
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+class Command(BaseCommand):
+    help = ('Run every API endpoint, EXPLAIN the queries it issues and '
+            'fail on sequential scans over large tables (PostgreSQL).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-rows', type=int, default=10000,
+            help='Tables with at least this many rows must not be '
+                 'scanned sequentially.')
+        parser.add_argument('--user', help='Email of the requesting user.')
+
+    def large_tables(self, min_rows):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relname FROM pg_class WHERE relkind = 'r' "
+                "AND reltuples >= %s", [min_rows])
+            return {name for name, in cursor.fetchall()}
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Query plans can only be checked on '
+                               'PostgreSQL.')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        large_tables = self.large_tables(options['min_rows'])
+        if options['user']:
+            user = User.objects.get(email=options['user'])
+        else:
+            user = (User.objects.filter(shopping_cart__isnull=False).first()
+                    or User.objects.first())
+        client = APIClient()
+        client.force_authenticate(user)
+        cache.clear()
+
+        violations = []
+        # Добавление и удаление идут парами, поэтому все запросы
+        # выполняются в одной транзакции, которая затем откатывается
+        with transaction.atomic():
+            for name, method, path in api_requests(user):
+                with CaptureQueriesContext(connection) as queries:
+                    response = getattr(client, method)(path)
+                if response.status_code >= 400:
+                    self.stderr.write(
+                        f'{name}: {method.upper()} {path} '
+                        f'-> {response.status_code}')
+                scans = []
+                for query in queries.captured_queries:
+                    sql = query['sql']
+                    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+                        continue
+                    scans += [
+                        node['Relation Name']
+                        for node in plan_nodes(self.explain(sql))
+                        if node['Node Type'] == 'Seq Scan'
+                        and node.get('Relation Name') in large_tables]
+                status = ('seq scan on ' + ', '.join(scans) if scans
+                          else 'ok')
+                self.stdout.write(
+                    f'{name:<35} {len(queries):>3} queries  {status}')
+                if scans:
+                    violations.append(name)
+            transaction.set_rollback(True)
+        if violations:
+            raise CommandError(
+                'Sequential scans on large tables in: '
+                + ', '.join(violations))
+        self.stdout.write(self.style.SUCCESS(
+            'No sequential scans on large tables.'))
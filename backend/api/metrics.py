@@ -0,0 +1,215 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import AllowAny
+
+from .profiling import SerializerTimer
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+NUMBER = re.compile(r'\b\d+\b')
+
+
+def query_shape(sql):
+    '''SQL без значений: запросы одной формы, повторённые в одном
+    ответе, — признак N+1'''
+    return NUMBER.sub('?', IN_LIST.sub('IN (...)', sql))
+
+
+class QueryRecorder:
+    '''Обёртка connection.execute_wrapper: число, время
+    и формы запросов одного HTTP-запроса'''
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def duplicates(self):
+        return {shape: count for shape, count in self.shapes.items()
+                if count >= settings.METRICS_DUPLICATE_QUERIES}
+
+
+class MetricsRegistry:
+    '''Счётчики по эндпоинтам в памяти процесса'''
+    FIELDS = ('requests', 'queries', 'sql_seconds', 'app_seconds',
+              'render_seconds', 'response_bytes', 'duplicate_queries')
+    HISTOGRAMS = ('request_duration_seconds', 'serialize_duration_seconds')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, status, duration, serialize_seconds=None,
+               **values):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                'statuses': Counter(),
+                'histograms': {name: {'buckets': [0] * len(DURATION_BUCKETS),
+                                      'sum': 0.0, 'count': 0}
+                               for name in self.HISTOGRAMS},
+                **dict.fromkeys(self.FIELDS, 0)})
+            stats['statuses'][status] += 1
+            self.observe(stats, 'request_duration_seconds', duration)
+            if serialize_seconds is not None:
+                self.observe(stats, 'serialize_duration_seconds',
+                             serialize_seconds)
+            stats['requests'] += 1
+            for field, value in values.items():
+                stats[field] += value
+
+    @staticmethod
+    def observe(stats, name, value):
+        histogram = stats['histograms'][name]
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                histogram['buckets'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+    def render(self):
+        '''Текстовый формат Prometheus'''
+        lines = []
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            for field in self.FIELDS:
+                name = f'foodgram_{field}_total'
+                lines.append(f'# TYPE {name} counter')
+                lines += [f'{name}{{endpoint="{endpoint}"}} {stats[field]}'
+                          for endpoint, stats in endpoints]
+            name = 'foodgram_responses_total'
+            lines.append(f'# TYPE {name} counter')
+            for endpoint, stats in endpoints:
+                lines += [
+                    f'{name}{{endpoint="{endpoint}",status="{status}"}} '
+                    f'{count}'
+                    for status, count in sorted(stats['statuses'].items())]
+            for histogram in self.HISTOGRAMS:
+                name = f'foodgram_{histogram}'
+                lines.append(f'# TYPE {name} histogram')
+                for endpoint, stats in endpoints:
+                    lines += self.render_histogram(
+                        name, endpoint, stats['histograms'][histogram])
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def render_histogram(name, endpoint, histogram):
+        if not histogram['count']:
+            return []
+        lines = [f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} '
+                 f'{count}'
+                 for bound, count in zip(DURATION_BUCKETS,
+                                         histogram['buckets'])]
+        return lines + [
+            f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} '
+            f'{histogram["count"]}',
+            f'{name}_sum{{endpoint="{endpoint}"}} {histogram["sum"]:.6f}',
+            f'{name}_count{{endpoint="{endpoint}"}} {histogram["count"]}']
+
+
+registry = MetricsRegistry()
+
+
+def endpoint_name(request, view_func):
+    '''Имя действия DRF вида RecipeViewSet.list или модуль.функция'''
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+class MetricsMiddleware:
+    '''Число и время SQL-запросов, время сериализации, обработки
+    и отрисовки ответа и его размер для каждого эндпоинта'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request._metrics = {'endpoint': 'unmatched', 'render_started': None,
+                            'render_seconds': 0.0}
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            serializer_timer = stack.enter_context(SerializerTimer())
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        metrics = request._metrics
+        render_seconds = metrics['render_seconds']
+        app_seconds = max(duration - recorder.duration - render_seconds, 0)
+        duplicates = recorder.duplicates()
+        if duplicates:
+            logger.warning(
+                '%s repeated queries %s', metrics['endpoint'],
+                '; '.join(f'{count}x {shape}'
+                          for shape, count in duplicates.items()))
+        registry.record(
+            metrics['endpoint'], response.status_code, duration,
+            serialize_seconds=(serializer_timer.elapsed
+                               if serializer_timer.calls else None),
+            queries=recorder.count, sql_seconds=recorder.duration,
+            app_seconds=app_seconds, render_seconds=render_seconds,
+            response_bytes=(0 if response.streaming
+                            else len(response.content)),
+            duplicate_queries=sum(duplicates.values()))
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = ', '.join((
+                f'db;dur={recorder.duration * 1000:.1f};'
+                f'desc="{recorder.count} queries"',
+                f'app;dur={app_seconds * 1000:.1f}',
+                f'serialize;dur={serializer_timer.elapsed * 1000:.1f}',
+                f'render;dur={render_seconds * 1000:.1f}',
+                f'total;dur={duration * 1000:.1f}'))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics['endpoint'] = endpoint_name(request, view_func)
+
+    def process_template_response(self, request, response):
+        # Ответы DRF отрисовываются после всех middleware:
+        # замеряем от этого момента до post-render callback
+        metrics = request._metrics
+        metrics['render_started'] = time.perf_counter()
+
+        def rendered(response):
+            metrics['render_seconds'] = (
+                time.perf_counter() - metrics['render_started'])
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+@api_view(['GET'])
+@permission_classes((AllowAny,))
+def metrics_view(request):
+    '''Метрики для Prometheus; доступны персоналу или по токену'''
+    token = settings.METRICS_TOKEN
+    if not (request.user.is_staff or (
+            token and request.headers.get('X-Metrics-Token') == token)):
+        raise PermissionDenied()
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -1,5 +1,130 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class KeysetPagination(BasePagination):
+    '''Постраничный вывод по ключу сортировки вместо OFFSET.
+    Глубина страницы не влияет на скорость, а новые записи
+    не сдвигают уже показанные. Общее количество не считается,
+    по ?count=approx берётся оценка планировщика PostgreSQL'''
+    ordering = None
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    count_query_param = 'count'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, instance):
+        values = [
+            instance._meta.get_field(field.lstrip('-')).value_to_string(
+                instance)
+            for field in self.ordering]
+        return base64.urlsafe_b64encode(
+            json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, request, model):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(token.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, values):
+        '''Условие «строго после ключа» для составной сортировки'''
+        condition = Q()
+        for position, field in enumerate(self.ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{f'{field.lstrip("-")}__{lookup}': values[position]})
+            for previous, value in zip(self.ordering, values[:position]):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def approximate_count(self, queryset):
+        if connection.vendor != 'postgresql':
+            return None
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'approx':
+            self.count = self.approximate_count(queryset)
+        cursor = self.decode_cursor(request, queryset.model)
+        queryset = queryset.order_by(*self.ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(cursor))
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
+
+
+class RecipeKeysetPagination(KeysetPagination):
+    ordering = ('-pub_date', '-id')
+
+
+class UserKeysetPagination(KeysetPagination):
+    ordering = ('id',)
+
+
+class KeysetPaginationMixin:
+    '''Включает постраничный вывод по ключу, если в запросе
+    есть параметр cursor (пустой — первая страница)'''
+    keyset_pagination_class = None
+
+    def use_keyset_pagination(self):
+        return (self.keyset_pagination_class is not None
+                and KeysetPagination.cursor_query_param
+                in self.request.query_params)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.use_keyset_pagination():
+            self._paginator = self.keyset_pagination_class()
+        return super().paginator
@@ -0,0 +1,180 @@
+import cProfile
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.serializers import ListSerializer, Serializer
+from rest_framework.settings import api_settings
+
+UNSAFE_CHARS = re.compile(r'[^\w.-]+')
+
+
+class SqlLog:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                (time.perf_counter() - started, sql, params))
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as output:
+            total = sum(duration for duration, _, _ in self.queries)
+            output.write(f'-- {len(self.queries)} queries, '
+                         f'{total * 1000:.1f} ms\n')
+            for duration, sql, params in self.queries:
+                output.write(f'\n-- {duration * 1000:.2f} ms\n{sql};\n'
+                             f'-- params: {params!r}\n')
+
+
+current_timer = ContextVar('serializer_timer', default=None)
+
+
+class SerializerTimer:
+    '''Время построения serializer.data внутри блока with.
+    Вложенные .data (в SerializerMethodField) входят во внешний
+    и отдельно не считаются. Таймер хранится в contextvar, так что
+    параллельные запросы в других потоках не влияют на замер.
+    Вложенный таймер по выходе добавляет своё время внешнему'''
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self.calls = 0
+        self.depth = 0
+
+    def __enter__(self):
+        self.outer = current_timer.get()
+        self.token = current_timer.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        current_timer.reset(self.token)
+        if self.outer is not None:
+            self.outer.elapsed += self.elapsed
+            self.outer.calls += self.calls
+
+
+def timed_data(prop):
+    def data(serializer):
+        timer = current_timer.get()
+        if timer is None or timer.depth:
+            return prop.fget(serializer)
+        timer.depth += 1
+        started = time.perf_counter()
+        try:
+            return prop.fget(serializer)
+        finally:
+            timer.depth -= 1
+            timer.calls += 1
+            timer.elapsed += time.perf_counter() - started
+
+    data.timed = True
+    return property(data)
+
+
+def install_serializer_timer():
+    '''Один раз при запуске: Serializer.data и ListSerializer.data
+    отчитываются перед SerializerTimer текущего контекста'''
+    for serializer_class in (Serializer, ListSerializer):
+        if not getattr(serializer_class.data.fget, 'timed', False):
+            serializer_class.data = timed_data(serializer_class.data)
+
+
+class ProfilingMiddleware:
+    '''Профилирование отдельного запроса персонала по заголовку
+    X-Profile или параметру ?profile=1: профиль cProfile и список
+    SQL-запросов сохраняются в PROFILING_DIR'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+        self.recent = deque()
+
+    def requested(self, request):
+        return settings.PROFILING_DIR and (
+            request.headers.get('X-Profile') == '1'
+            or request.GET.get('profile') == '1')
+
+    def is_staff(self, request):
+        # Middleware работает до аутентификации DRF, поэтому
+        # токен проверяется теми же классами, что и в API
+        if getattr(request, 'user', None) and request.user.is_staff:
+            return True
+        drf_request = Request(request)
+        for authentication_class in (
+                api_settings.DEFAULT_AUTHENTICATION_CLASSES):
+            try:
+                result = authentication_class().authenticate(drf_request)
+            except APIException:
+                return False
+            if result is not None:
+                return result[0].is_staff
+        return False
+
+    def acquire_slot(self):
+        '''Не больше PROFILING_RATE профилей в минуту на процесс'''
+        now = time.monotonic()
+        with self.lock:
+            while self.recent and now - self.recent[0] > 60:
+                self.recent.popleft()
+            if len(self.recent) >= settings.PROFILING_RATE:
+                return False
+            self.recent.append(now)
+            return True
+
+    def __call__(self, request):
+        if not (self.requested(request) and self.is_staff(request)
+                and self.acquire_slot()):
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        sql_log = SqlLog()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(sql_log))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+                if response.streaming:
+                    # Потоковый ответ формируется при отдаче:
+                    # собираем его под профилировщиком
+                    response.streaming_content = [
+                        b''.join(response.streaming_content)]
+            finally:
+                profiler.disable()
+        response['X-Profile-Id'] = self.save(request, profiler, sql_log)
+        return response
+
+    def save(self, request, profiler, sql_log):
+        directory = settings.PROFILING_DIR
+        os.makedirs(directory, exist_ok=True)
+        name = UNSAFE_CHARS.sub(
+            '_', f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid4().hex[:6]}-'
+                 f'{request.method}{request.path}').strip('_')[:150]
+        profiler.dump_stats(os.path.join(directory, name + '.prof'))
+        sql_log.dump(os.path.join(directory, name + '.sql'))
+        self.trim(directory)
+        return name
+
+    def trim(self, directory):
+        '''Удаляет старые профили сверх PROFILING_MAX_BYTES'''
+        files = sorted(
+            (entry for entry in os.scandir(directory) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime, reverse=True)
+        total = 0
+        for entry in files:
+            total += entry.stat().st_size
+            if total > settings.PROFILING_MAX_BYTES:
+                os.remove(entry.path)
@@ -0,0 +1,52 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    '''JSONRenderer на orjson: в разы быстрее на больших страницах.
+    Без orjson, а также для отступов в ответе — обычный рендер DRF'''
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(
+                accepted_media_type or '', renderer_context or {}):
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        # Даты, ленивые строки, Decimal и прочее кодируются
+        # через default так же, как в DRF
+        ret = orjson.dumps(
+            data, default=JSONEncoder().default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        # Как и DRF: U+2028 и U+2029 недопустимы в JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ExportRenderer(BaseRenderer):
+    '''Разрешает ?format= для выгрузок. Сам файл отдаётся потоком
+    в обход рендера, сюда попадают только ответы с ошибками'''
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data)
+
+
+class TxtExportRenderer(ExportRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CsvExportRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PdfExportRenderer(ExportRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
@@ -0,0 +1,97 @@
+import re
+from difflib import SequenceMatcher
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            TrigramSimilarity)
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Q, When
+
+from recipe.models import RecipeIngredients
+from .ingredient_index import normalize
+
+SEARCH_CONFIG = 'russian'
+TYPO_RATIO = 0.7
+# Вес совпадения в названии, описании и ингредиентах, как A/B/C в tsvector
+FIELD_WEIGHTS = (1.0, 0.4, 0.2)
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'иях', 'ах', 'ях', 'ов', 'ев', 'ей', 'ой', 'ий', 'ый', 'ая', 'яя',
+    'ое', 'ее', 'ые', 'ие', 'ом', 'ем', 'ам', 'ям', 'ую', 'юю', 'ью',
+    'ия', 'ья', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+
+def stem(word):
+    '''Грубое отсечение русских окончаний для запасного поиска'''
+    for ending in RUSSIAN_ENDINGS:
+        if (word.endswith(ending)
+                and len(word) - len(ending) >= MIN_STEM_LENGTH):
+            return word[:-len(ending)]
+    return word
+
+
+def stems(text):
+    return {stem(word) for word in re.findall(r'\w+', normalize(text))}
+
+
+def _term_score(term, field_stems):
+    if term in field_stems:
+        return 1.0
+    # Опечатка: засчитываем половину веса за близкое слово
+    if any(SequenceMatcher(None, term, candidate).ratio() >= TYPO_RATIO
+           for candidate in field_stems):
+        return 0.5
+    return 0.0
+
+
+def rank_documents(query, documents):
+    '''Ранжирует документы (id, название, описание, ингредиенты)
+    так же, как SearchRank по взвешенному tsvector'''
+    terms = stems(query)
+    ranked = []
+    for pk, *fields in documents:
+        fields_stems = [stems(field) for field in fields]
+        score = sum(
+            weight * _term_score(term, field_stems)
+            for term in terms
+            for weight, field_stems in zip(FIELD_WEIGHTS, fields_stems))
+        if score:
+            ranked.append((-score, pk))
+    ranked.sort()
+    return [pk for _, pk in ranked]
+
+
+def _python_search(queryset, query):
+    ingredients = {}
+    for recipe_id, name in (
+            RecipeIngredients.objects
+            .filter(recipe__in=queryset.values('pk'))
+            .values_list('recipe_id', 'ingredient__name')):
+        ingredients.setdefault(recipe_id, []).append(name)
+    documents = (
+        (pk, name, text, ' '.join(ingredients.get(pk, ())))
+        for pk, name, text in queryset.values_list('pk', 'name', 'text'))
+    ids = rank_documents(query, documents)
+    return queryset.filter(pk__in=ids).order_by(Case(
+        *[When(pk=pk, then=position) for position, pk in enumerate(ids)],
+        output_field=IntegerField()))
+
+
+def search_recipes(queryset, query):
+    '''Рецепты по названию, описанию и ингредиентам по убыванию
+    релевантности. На PostgreSQL используется сохранённый tsvector
+    с GIN-индексом и триграммы для опечаток, на остальных БД —
+    ранжирование на Python'''
+    if connection.vendor != 'postgresql':
+        return _python_search(queryset, query)
+    search_query = SearchQuery(
+        query, config=SEARCH_CONFIG, search_type='websearch')
+    return (
+        queryset
+        .annotate(rank=SearchRank(F('search_vector'), search_query),
+                  similarity=TrigramSimilarity('name', query))
+        .filter(Q(search_vector=search_query)
+                | Q(name__trigram_similar=query))
+        .order_by('-rank', '-similarity', '-pub_date')
+    )
@@ -1,6 +1,6 @@
-import base64
+from functools import partial
 
-from django.core.files.base import ContentFile
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core import exceptions
@@ -12,25 +12,53 @@ from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from recipe.models import (Ingredient, Tag, Recipe,
-                           Favorite, ShoppingСart,
-                           RecipeIngredients,)
-from users.models import Subscribe
+                           RecipeIngredients, ShoppingCartIngredient,)
+from recipe.relations import user_relations
+from .fieldsets import SparseFieldsetSerializerMixin
+from .uploads import check_image, decode_base64_image
 
 User = get_user_model()
 
 
 class Base64ImageField(serializers.ImageField):
+    def __init__(self, rendition=None, **kwargs):
+        self.rendition = rendition
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        '''Отдаёт копию картинки под контекст: карточку в списках,
+        крупную копию на странице рецепта'''
+        recipe = getattr(value, 'instance', None)
+        if not value or not isinstance(recipe, Recipe):
+            return super().to_representation(value)
+        url = recipe.image_url(
+            self.rendition or self.context.get('image_rendition', 'detail'),
+            settings.IMAGE_RENDITION_FORMAT)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+        if isinstance(data, str):
+            data = decode_base64_image(data)
+        elif hasattr(data, 'size'):
+            # Файл из multipart-запроса проверяется так же, как base64,
+            # а расширение берётся по содержимому
+            extension, _ = check_image(data, data.size)
+            data.name = f'image.{extension}'
         return super().to_internal_value(data)
 
 
-class UserListSerializer(UserSerializer):
+class UserListSerializer(SparseFieldsetSerializerMixin, UserSerializer):
     """Вывод списка пользователей"""
     is_subscribed = serializers.SerializerMethodField()
+    sparse_columns = {'is_subscribed': ()}
+    # Рецепты автора карточками; ?recipes_limit= ограничивает число
+    expandable_fields = {
+        'recipes': lambda: FavouriteRecipeSerializer(
+            source='limited_recipes', many=True, read_only=True),
+    }
 
     class Meta:
         model = User
@@ -39,12 +67,9 @@ class UserListSerializer(UserSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        if request:
-            if not request.user.is_anonymous:
-                return Subscribe.objects.filter(
-                    user=request.user,
-                    author=obj).exists()
-        return False
+        if request is None:
+            return False
+        return user_relations(request).is_subscribed(obj.pk)
 
 
 class SignUpSerializer(UserCreateSerializer):
@@ -98,7 +123,7 @@ class PasswordSerializer(serializers.Serializer):
 
 class FavouriteRecipeSerializer(serializers.ModelSerializer):
     """Вывод списка рецептов из избранного"""
-    image = Base64ImageField(read_only=True)
+    image = Base64ImageField(rendition='card', read_only=True)
 
     class Meta:
         model = Recipe
@@ -106,6 +131,18 @@ class FavouriteRecipeSerializer(serializers.ModelSerializer):
         read_only_fields = ['name', 'cooking_time',]
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Рецепты для массового добавления в избранное или корзину"""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=settings.BULK_RECIPES_MAX)
+
+    def validate_recipes(self, recipes):
+        # Несуществующие и уже добавленные рецепты пропускает
+        # add_relations: удалённый рецепт не ломает весь список
+        return list(dict.fromkeys(recipes))
+
+
 class SubscriptionListSerializer(serializers.ModelSerializer):
     """Вывод подписчиков пользователя"""
     recipes_amount = serializers.SerializerMethodField()
@@ -119,24 +156,19 @@ class SubscriptionListSerializer(serializers.ModelSerializer):
                   'recipes_amount',)
 
     def get_recipes_amount(self, obj):
-        return obj.recipe.count()
+        return obj.recipes_count
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if not request.user.is_anonymous:
-            return Subscribe.objects.filter(
-                user=request.user,
-                author=obj).exists()
-        return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return user_relations(
+            self.context.get('request')).is_subscribed(obj.pk)
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes = obj.recipe.all()
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit in request.GET:
-            recipes_limit = request.GET['recipes_limit']
-            recipes = recipes[:int(recipes_limit)]
-        return FavouriteRecipeSerializer(recipes, many=True).data
+        # limited_recipes подгружает author_recipes() с учётом
+        # recipes_limit
+        return FavouriteRecipeSerializer(obj.limited_recipes,
+                                         many=True).data
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
@@ -154,35 +186,31 @@ class SubscribeSerializer(serializers.ModelSerializer):
         read_only_fields = ['email', 'username',]
 
     def validate(self, obj):
-        if (self.context.get('request').user == obj):
+        if self.context.get('request').user == self.instance:
             raise ValidationError({'errors': 
                                    'Нельзя подписаться на себя!'})
         return obj
 
     def get_recipes_amount(self, obj):
-        return obj.recipe.count()
+        return obj.recipes_count
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if not request.user.is_anonymous:
-            return Subscribe.objects.filter(
-                user=request.user,
-                author=obj).exists()
-        return False
+        return user_relations(
+            self.context.get('request')).is_subscribed(obj.pk)
 
 
 class TagListSerializer(serializers.ModelSerializer):
     """Вывод списка тэгов"""
     class Meta:
         model = Tag
-        fields = '__all__'
+        fields = ('id', 'name', 'color', 'slug')
 
 
 class IngredientsListSerializer(serializers.ModelSerializer):
     """Вывод списка ингридиентов"""
     class Meta:
         model = Ingredient
-        fields = '__all__'
+        fields = ('id', 'name', 'measurement_unit')
 
 
 class RecipeIngrediensSerializer(serializers.ModelSerializer):
@@ -199,7 +227,8 @@ class RecipeIngrediensSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(SparseFieldsetSerializerMixin,
+                           serializers.ModelSerializer):
     """Вывод списка рецептов"""
     author = UserListSerializer(read_only=True)
     image = Base64ImageField()
@@ -219,26 +248,42 @@ class RecipeListSerializer(serializers.ModelSerializer):
                   'ingredients', 'tags', 'cooking_time', 
                   'is_in_shopping_cart', 'is_favorited')
 
+    # Без ?expand= связи выводятся идентификаторами
+    collapsed_fields = {
+        'author': partial(serializers.PrimaryKeyRelatedField,
+                          read_only=True),
+        'tags': partial(serializers.PrimaryKeyRelatedField,
+                        many=True, read_only=True),
+        'ingredients': partial(serializers.SerializerMethodField,
+                               method_name='get_ingredient_amounts'),
+    }
+    sparse_columns = {
+        'image': ('image', 'renditions'),
+        'ingredients': (),
+        'tags': (),
+        'is_favorited': (),
+        'is_in_shopping_cart': (),
+    }
+
     def get_ingredients(self, obj):
-        ingredients = RecipeIngredients.objects.filter(recipe=obj)
+        ingredients = obj.recipe_ingredient.all()
         serializer = RecipeIngrediensSerializer(ingredients, many=True)
 
         return serializer.data
 
+    def get_ingredient_amounts(self, obj):
+        return [{'id': row.ingredient_id, 'amount': row.amount}
+                for row in obj.recipe_ingredient.all()]
+
     def get_is_favorited(self, obj):
         '''Проверка рецепта на наличие в избранном'''
-        return (
-            self.context.get('request').user.is_authenticated
-            and Favorite.objects.filter(
-                user=self.context.get('request').user, recipe=obj).exists())
+        return user_relations(
+            self.context.get('request')).is_favorited(obj.pk)
 
     def get_is_in_shopping_cart(self, obj):
         '''Проверка рецепта на наличие в списке покупок'''
-        return (
-            self.context.get('request').user.is_authenticated
-            and ShoppingСart.objects.filter(
-                user=self.context.get('request').user,
-                recipe=obj).exists())
+        return user_relations(
+            self.context.get('request')).is_in_shopping_cart(obj.pk)
 
 
 class IngredientsInReipe(serializers.ModelSerializer):
@@ -263,8 +308,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     author = UserListSerializer(read_only=True)
     image = Base64ImageField()
     ingredients = IngredientsInReipe(many=True)
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
+    tags = serializers.ListField(child=serializers.IntegerField())
     cooking_time = serializers.IntegerField(min_value=1)
 
     class Meta:
@@ -295,24 +339,60 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Ингредиенты не могут повторяться'
             )
+        found = Ingredient.objects.in_bulk(ing)
+        missing = [pk for pk in ing if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {missing}')
         return ingredients
 
+    def validate_tags(self, tags):
+        found = Tag.objects.in_bulk(tags)
+        missing = [pk for pk in tags if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                f'Теги не найдены: {missing}')
+        return list(dict.fromkeys(tags))
+
     def validate_cooking_time(self, value):
         if value <= 0:
             raise serializers.ValidationError(
                 'Время приготовления должно быть больше 0')
         return value
     
-    @transaction.atomic
-    def tags_and_ingredients_set(self, recipe, tags, ingredients):
-        recipe.tags.set(tags)
+    def set_tags(self, recipe, tag_ids, old_tag_ids=()):
+        '''Изменяет только разницу между старым и новым набором тегов'''
+        through = Recipe.tags.through
+        removed = set(old_tag_ids) - set(tag_ids)
+        if removed:
+            through.objects.filter(recipe=recipe,
+                                   tag_id__in=removed).delete()
+        through.objects.bulk_create(
+            [through(recipe=recipe, tag_id=tag_id)
+             for tag_id in tag_ids if tag_id not in old_tag_ids])
+
+    def set_ingredients(self, recipe, ingredients, old_rows=None):
+        '''Вставляет, обновляет и удаляет только изменившиеся строки.
+        old_rows — прежние строки рецепта {ingredient_id: строка}'''
+        old_rows = old_rows or {}
+        new_amounts = {item['id']: item['amount'] for item in ingredients}
+        changed = []
+        for ingredient_id, row in old_rows.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        removed = [row.pk for ingredient_id, row in old_rows.items()
+                   if ingredient_id not in new_amounts]
+        if removed:
+            RecipeIngredients.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredients.objects.bulk_update(changed, ['amount'])
         RecipeIngredients.objects.bulk_create(
-            [RecipeIngredients(
-                recipe=recipe,
-                ingredient=Ingredient.objects.get(pk=ingredient['id']),
-                amount=ingredient['amount']
-            ) for ingredient in ingredients]
-        )
+            [RecipeIngredients(recipe=recipe, ingredient_id=ingredient_id,
+                               amount=amount)
+             for ingredient_id, amount in new_amounts.items()
+             if ingredient_id not in old_rows])
 
     @transaction.atomic
     def create(self, validated_data):
@@ -321,7 +401,9 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(author=self.context['request'].user,
                                        **validated_data)
-        self.tags_and_ingredients_set(recipe, tags, ingredients)
+        self.set_tags(recipe, tags)
+        self.set_ingredients(recipe, ingredients)
+        Recipe.objects.filter(pk=recipe.pk).update_search_vector()
         return recipe
 
     @transaction.atomic
@@ -333,13 +415,21 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             'cooking_time', instance.cooking_time)
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        RecipeIngredients.objects.filter(
-            recipe=instance,
-            ingredient__in=instance.ingredients.all()).delete()
-        self.tags_and_ingredients_set(instance, tags, ingredients)
+        old_rows = {row.ingredient_id: row
+                    for row in instance.recipe_ingredient.all()}
+        old_amounts = {ingredient_id: row.amount
+                       for ingredient_id, row in old_rows.items()}
+        self.set_tags(instance, tags, set(
+            instance.tags.values_list('pk', flat=True)))
+        self.set_ingredients(instance, ingredients, old_rows)
+        ShoppingCartIngredient.objects.recipe_changed(
+            instance, old_amounts,
+            {item['id']: item['amount'] for item in ingredients})
         instance.save()
+        Recipe.objects.filter(pk=instance.pk).update_search_vector()
         return instance
 
     def to_representation(self, instance):
+        instance = Recipe.objects.with_related().get(pk=instance.pk)
         return RecipeListSerializer(instance,
                                     context=self.context).data
@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from recipe.models import Ingredient, Recipe, RecipeIngredients, Tag
+from users.models import User
+from .authentication import forget_token
+from .cache import invalidate
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    # До фиксации транзакции другой запрос закэшировал бы
+    # под новой версией ещё старые данные
+    transaction.on_commit(lambda: invalidate('tags', 'recipes'))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate('ingredients', 'recipes'))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredients)
+@receiver(post_delete, sender=RecipeIngredients)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_changed(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate('recipes'))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: forget_token(key))
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Смена пароля, блокировка и правка профиля: в кэше
+    # аутентификации не должно остаться старой копии пользователя
+    user_id = instance.pk
+    keys = list(Token.objects.filter(user=instance).values_list(
+        'key', flat=True))
+
+    def forget():
+        for key in keys:
+            forget_token(key, user_id=user_id)
+
+    transaction.on_commit(forget)
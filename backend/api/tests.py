@@ -0,0 +1,849 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from base64 import b64encode, urlsafe_b64encode
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from recipe.images import strip_metadata
+from recipe.models import (Favorite, Ingredient, Recipe, RecipeIngredients,
+                           ShoppingCartIngredient, ShoppingСart, Tag)
+from users.models import Subscribe, User
+from .authentication import CachedTokenAuthentication, token_cache
+from .cache import namespace_version
+from .metrics import MetricsRegistry
+from .profiling import SerializerTimer
+from .serializers import SubscriptionListSerializer
+from .uploads import decode_base64_image
+from .views import author_recipes
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def image_bytes(format='PNG', size=(40, 30), **params):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, format, **params)
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_WORKERS=0)
+class FoodgramTestCase(APITestCase):
+    '''Авторы, теги, ингредиенты и рецепты для тестов API'''
+    recipes_count = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@example.com',
+                password='Passw0rd!x', first_name='Имя',
+                last_name='Фамилия')
+            for i in range(3)]
+        cls.tags = [
+            Tag.objects.create(
+                name=f'тег {i}', color=f'#00000{i}', slug=f'tag{i}')
+            for i in range(3)]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(10)]
+        cls.recipes = []
+        for i in range(cls.recipes_count):
+            recipe = Recipe(
+                author=cls.users[i % len(cls.users)], name=f'Рецепт {i}',
+                text='Описание', cooking_time=5)
+            recipe.image.save(
+                f'recipe{i}.png', ContentFile(image_bytes()), save=False)
+            recipe.save()
+            recipe.tags.set(cls.tags[:2])
+            for j in range(3):
+                RecipeIngredients.objects.create(
+                    recipe=recipe, amount=j + 1,
+                    ingredient=cls.ingredients[(i + j) % 10])
+            cls.recipes.append(recipe)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def stored_image(self, response):
+        self.assertEqual(response.status_code, 201, response.data)
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        with recipe.image.open('rb') as file:
+            image = Image.open(BytesIO(file.read()))
+            image.load()
+        return image
+
+
+class RecipeQueryCountTests(FoodgramTestCase):
+    '''Число запросов не зависит от размера страницы'''
+
+    def queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_anonymous(self):
+        self.assertEqual(self.queries('/api/recipes/?limit=1'),
+                         self.queries('/api/recipes/?limit=6'))
+
+    def test_list_authenticated(self):
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.queries('/api/recipes/?limit=1'),
+                         self.queries('/api/recipes/?limit=6'))
+
+    def test_list_page_number(self):
+        self.assertEqual(self.queries('/api/recipes/?page=1&limit=1'),
+                         self.queries('/api/recipes/?page=1&limit=6'))
+
+    def test_retrieve(self):
+        # Рецепт с автором, теги, строки ингредиентов и сами
+        # ингредиенты — без запроса на каждую связанную строку
+        recipe = self.recipes[0]
+        cache.clear()
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(len(response.data['ingredients']), 3)
+
+
+def data_url(content, content_type='image/jpeg'):
+    return f'data:{content_type};base64,{b64encode(content).decode()}'
+
+
+class UploadTests(FoodgramTestCase):
+    def decode(self, data):
+        upload = decode_base64_image(data)
+        return upload.name, Image.open(upload).size
+
+    def test_multipart_upload(self):
+        upload = SimpleUploadedFile(
+            'photo.bin', image_bytes('JPEG'),
+            content_type='application/octet-stream')
+        self.client.force_authenticate(self.users[0])
+        response = self.client.post('/api/recipes/', {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+            'tags': [self.tags[0].pk],
+            'ingredients[0]id': self.ingredients[0].pk,
+            'ingredients[0]amount': 5,
+            'image': upload}, format='multipart')
+        image = self.stored_image(response)
+        self.assertEqual(image.format, 'JPEG')
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        self.assertTrue(recipe.image.name.endswith('.jpeg'))
+
+    def test_type_sniffed_from_content(self):
+        content = image_bytes('JPEG')
+        self.assertEqual(self.decode(data_url(content, 'image/png')),
+                         ('image.jpeg', (40, 30)))
+
+    def test_chunk_boundaries_and_whitespace(self):
+        content = image_bytes('PNG', size=(64, 48))
+        encoded = b64encode(content).decode()
+        wrapped = '\n'.join(
+            encoded[i:i + 76] for i in range(0, len(encoded), 76))
+        with mock.patch('api.uploads.CHUNK_SIZE', 8):
+            self.assertEqual(
+                self.decode(f'data:image/png;base64,{wrapped}'),
+                ('image.png', (64, 48)))
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_size_limit_before_decoding(self):
+        with mock.patch('api.uploads.b64decode') as b64decode:
+            with self.assertRaises(ValidationError):
+                decode_base64_image(data_url(image_bytes('JPEG')))
+        b64decode.assert_not_called()
+
+    @override_settings(IMAGE_MAX_PIXELS=100)
+    def test_pixel_limit(self):
+        with self.assertRaises(ValidationError):
+            decode_base64_image(data_url(image_bytes('PNG')))
+
+    def test_rejected_data(self):
+        for data in ('data:image/png;base64,@@@@',
+                     data_url(b'<svg></svg>', 'image/svg+xml'),
+                     'not a data url'):
+            with self.subTest(data=data[:30]):
+                with self.assertRaises(ValidationError):
+                    decode_base64_image(data)
+
+
+class ProfilingTests(FoodgramTestCase):
+    def setUp(self):
+        super().setUp()
+        token_cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.staff = User.objects.create_user(
+            username='staff', email='staff@example.com', is_staff=True,
+            password='Passw0rd!x', first_name='Имя', last_name='Фамилия')
+
+    def profile(self, user, **headers):
+        token, _ = Token.objects.get_or_create(user=user)
+        with override_settings(PROFILING_DIR=self.directory):
+            return self.client.get('/api/recipes/', HTTP_X_PROFILE='1',
+                                   HTTP_AUTHORIZATION=f'Token {token}',
+                                   **headers)
+
+    def test_staff_request_profiled(self):
+        response = self.profile(self.staff)
+        self.assertEqual(response.status_code, 200)
+        name = response['X-Profile-Id']
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [f'{name}.prof', f'{name}.sql'])
+        with open(os.path.join(self.directory, f'{name}.sql'),
+                  encoding='utf-8') as sql:
+            self.assertIn('SELECT', sql.read())
+
+    def test_other_users_not_profiled(self):
+        response = self.profile(self.users[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('X-Profile-Id'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @override_settings(PROFILING_RATE=2)
+    def test_rate_limit(self):
+        profiled = [self.profile(self.staff).has_header('X-Profile-Id')
+                    for _ in range(3)]
+        self.assertEqual(profiled, [True, True, False])
+
+    @override_settings(PROFILING_MAX_BYTES=1024 * 1024)
+    def test_storage_bounded(self):
+        old = os.path.join(self.directory, 'old.prof')
+        with open(old, 'wb') as file:
+            file.write(b'0' * 1024 * 1024)
+        os.utime(old, (0, 0))
+        name = self.profile(self.staff)['X-Profile-Id']
+        # Свежий профиль остался, старый не уместился в предел
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [f'{name}.prof', f'{name}.sql'])
+
+
+@override_settings(TOKEN_REVOCATION_WINDOW=60)
+class TokenRevocationTests(APITestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='Passw0rd!x',
+            first_name='Имя', last_name='Фамилия')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def me(self):
+        return self.client.get('/api/users/me/').status_code
+
+    def test_logout(self):
+        self.assertEqual(self.me(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(self.me(), 401)
+
+    def test_set_password(self):
+        self.assertEqual(self.me(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/set_password/', {
+                'current_password': 'Passw0rd!x',
+                'new_password': 'N3w-passw0rd!'})
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(token_cache.get(self.token.key))
+        user, _ = CachedTokenAuthentication().authenticate_credentials(
+            self.token.key)
+        self.assertTrue(user.check_password('N3w-passw0rd!'))
+
+    def test_expires_within_window(self):
+        self.assertEqual(self.me(), 200)
+        # Токен удалён другим процессом: этот о выходе не узнал
+        with mock.patch('api.signals.forget_token'):
+            Token.objects.filter(pk=self.token.pk).delete()
+        self.assertEqual(self.me(), 200)
+        now = mock.patch('api.authentication.time.monotonic',
+                         return_value=time.monotonic() + 60)
+        with now:
+            self.assertEqual(self.me(), 401)
+
+    def test_fresh_user_per_request(self):
+        authentication = CachedTokenAuthentication()
+        first, _ = authentication.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            second, _ = authentication.authenticate_credentials(
+                self.token.key)
+        self.assertIsNot(first, second)
+        self.assertEqual(first.pk, second.pk)
+        first.first_name = 'Другое'
+        self.assertEqual(second.first_name, 'Имя')
+
+
+class CachedResponseTests(FoodgramTestCase):
+    def test_not_modified_with_etag(self):
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_no_last_modified(self):
+        # Версия пространства — время сброса кэша в процессе, а не
+        # изменения данных: условные запросы проверяются только по ETag
+        response = self.client.get('/api/recipes/')
+        self.assertNotIn('Last-Modified', response)
+        response = self.client.get(
+            '/api/recipes/',
+            HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalidate_after_commit(self):
+        self.client.get('/api/recipes/')
+        version = namespace_version('recipes')
+        recipe = self.recipes[0]
+        with self.captureOnCommitCallbacks() as callbacks:
+            recipe.name = 'Новое название'
+            recipe.save()
+            # До фиксации кэш ещё не сброшен
+            self.assertEqual(namespace_version('recipes'), version)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(namespace_version('recipes'), version)
+        response = self.client.get(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response.data['name'], 'Новое название')
+
+    @override_settings(API_CACHE_VERSION_TIMEOUT=15)
+    def test_namespace_version_expires(self):
+        with mock.patch('time.time', return_value=1000.0):
+            self.assertEqual(namespace_version('recipes'), 1000)
+        with mock.patch('time.time', return_value=1010.0):
+            self.assertEqual(namespace_version('recipes'), 1000)
+        # Другие воркеры не видят invalidate: версия в их
+        # кэше должна устареть сама
+        with mock.patch('time.time', return_value=1016.0):
+            self.assertEqual(namespace_version('recipes'), 1016)
+
+
+class IngredientSearchTests(FoodgramTestCase):
+    def search(self, **headers):
+        return self.client.get('/api/ingredients/?name=ингр', **headers)
+
+    def test_not_modified_with_catalog_etag(self):
+        response = self.search()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 10)
+        etag = response['ETag']
+        # Один запрос — версия справочника
+        with self.assertNumQueries(1):
+            response = self.search(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_index_follows_catalog_version(self):
+        etag = self.search()['ETag']
+        # Сброс кэша API выполняется после фиксации, которой в тесте
+        # нет: индекс обновляется по версии справочника в БД
+        Ingredient.objects.create(name='ингредиент новый',
+                                  measurement_unit='г')
+        response = self.search(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('ингредиент новый',
+                      [row['name'] for row in response.data])
+
+
+class KeysetPaginationTests(FoodgramTestCase):
+    recipes_count = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # По три рецепта с одной датой: порядок внутри решает id
+        start = timezone.now()
+        for recipe in cls.recipes:
+            Recipe.objects.filter(pk=recipe.pk).update(
+                pub_date=start - timedelta(minutes=recipe.pk // 3))
+
+    def walk(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([item['id'] for item in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_recipes_walk(self):
+        pages = self.walk('/api/recipes/?cursor=&limit=7')
+        self.assertEqual([len(page) for page in pages], [7, 7, 6])
+        self.assertEqual(
+            sum(pages, []),
+            list(Recipe.objects.order_by('-pub_date', '-id')
+                 .values_list('id', flat=True)))
+
+    def test_recipe_added_during_walk(self):
+        response = self.client.get('/api/recipes/?cursor=&limit=7')
+        first = [item['id'] for item in response.data['results']]
+        # Новый рецепт не сдвигает следующую страницу
+        Recipe.objects.create(
+            author=self.users[0], name='Новый', text='Описание',
+            image='recipe/test.png', cooking_time=5)
+        rest = sum(self.walk(response.data['next']), [])
+        self.assertEqual(len(first + rest), self.recipes_count)
+        self.assertFalse(set(first) & set(rest))
+
+    def test_invalid_cursor(self):
+        wrong_length = urlsafe_b64encode(b'[1]').decode()
+        for cursor in ('garbage', wrong_length):
+            response = self.client.get(f'/api/recipes/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404)
+
+    def test_users_walk(self):
+        pages = self.walk('/api/users/?cursor=&limit=2')
+        self.assertEqual(sum(pages, []),
+                         sorted(user.pk for user in self.users))
+        self.assertEqual(len(pages), 2)
+
+
+class RecipeUpdateTests(FoodgramTestCase):
+    '''PATCH рецепта пишет только изменившиеся строки'''
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[0]
+        self.client.force_authenticate(self.recipe.author)
+        self.amounts = dict(self.recipe.recipe_ingredient.values_list(
+            'ingredient_id', 'amount'))
+
+    def patch(self, amounts, tags=None):
+        payload = {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 5,
+            'tags': tags or [tag.pk for tag in self.tags[:2]],
+            'ingredients': [{'id': pk, 'amount': amount}
+                            for pk, amount in amounts.items()]}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/', payload, format='json')
+        self.queries = context.captured_queries
+        return response
+
+    def writes(self, model):
+        table = f'"{model._meta.db_table}"'
+        return sorted(
+            query['sql'].split()[0] for query in self.queries
+            if query['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')
+            and table in query['sql'].split('WHERE')[0])
+
+    def rows(self):
+        return dict(self.recipe.recipe_ingredient.values_list(
+            'ingredient_id', 'pk'))
+
+    def test_unchanged(self):
+        rows = self.rows()
+        response = self.patch(self.amounts)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.writes(RecipeIngredients), [])
+        self.assertEqual(self.writes(Recipe.tags.through), [])
+        self.assertEqual(self.rows(), rows)
+
+    def test_changed_amounts_are_updated(self):
+        rows = self.rows()
+        amounts = {pk: amount + 10 for pk, amount in self.amounts.items()}
+        self.assertEqual(self.patch(amounts).status_code, 200)
+        self.assertEqual(self.writes(RecipeIngredients), ['UPDATE'])
+        self.assertEqual(self.rows(), rows)
+        self.assertEqual(dict(self.recipe.recipe_ingredient.values_list(
+            'ingredient_id', 'amount')), amounts)
+        # Число запросов не растёт с числом изменённых строк
+        queries = len(self.queries)
+        amounts[next(iter(amounts))] += 1
+        self.patch(amounts)
+        self.assertEqual(len(self.queries), queries)
+
+    def test_removed_ingredients_are_deleted(self):
+        rows = self.rows()
+        removed, *kept = self.amounts
+        self.patch({pk: self.amounts[pk] for pk in kept})
+        self.assertEqual(self.writes(RecipeIngredients), ['DELETE'])
+        del rows[removed]
+        self.assertEqual(self.rows(), rows)
+
+    def test_added_ingredient_and_tags_diff(self):
+        added = self.ingredients[9].pk
+        response = self.patch({**self.amounts, added: 7},
+                              tags=[self.tags[1].pk, self.tags[2].pk])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.writes(RecipeIngredients), ['INSERT'])
+        self.assertEqual(self.writes(Recipe.tags.through),
+                         ['DELETE', 'INSERT'])
+        self.assertEqual(
+            set(self.recipe.tags.values_list('pk', flat=True)),
+            {self.tags[1].pk, self.tags[2].pk})
+
+    def test_unknown_ids(self):
+        rows = self.rows()
+        response = self.patch({**self.amounts, 10 ** 6: 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ingredients', response.data)
+        response = self.patch(self.amounts, tags=[10 ** 6])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tags', response.data)
+        self.assertEqual(self.writes(RecipeIngredients), [])
+        self.assertEqual(self.rows(), rows)
+
+
+def exif_with_location(orientation=1):
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif[0x010F] = 'Camera'
+    # GPSInfo: широта 55°45'
+    exif.get_ifd(0x8825).update({1: 'N', 2: (55.0, 45.0, 0.0)})
+    return exif
+
+
+class ImageMetadataTests(FoodgramTestCase):
+    def create_recipe(self, image, format='json'):
+        payload = {'name': 'Рецепт с фото', 'text': 'Описание',
+                   'cooking_time': 10, 'tags': [self.tags[0].pk],
+                   'image': image}
+        if format == 'json':
+            payload['ingredients'] = [
+                {'id': self.ingredients[0].pk, 'amount': 5}]
+        else:
+            payload['ingredients[0]id'] = self.ingredients[0].pk
+            payload['ingredients[0]amount'] = 5
+        self.client.force_authenticate(self.users[0])
+        # Оригинал переписывает пул обработки после фиксации
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/recipes/', payload,
+                                    format=format)
+
+    def test_request_stores_decoded_bytes(self):
+        content = image_bytes('JPEG', exif=exif_with_location())
+        upload = decode_base64_image(data_url(content))
+        self.assertEqual(upload.read(), content)
+
+    def test_base64_original_has_no_exif(self):
+        content = image_bytes('JPEG', exif=exif_with_location())
+        self.assertTrue(Image.open(BytesIO(content)).getexif())
+        response = self.create_recipe(data_url(content))
+        image = self.stored_image(response)
+        self.assertEqual(image.format, 'JPEG')
+        self.assertFalse(image.getexif())
+        self.assertNotIn('exif', image.info)
+        # Оригинал переписан под прежним именем
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        self.assertEqual(recipe.renditions['source'], recipe.image.name)
+
+    def test_orientation_applied_to_pixels(self):
+        content = image_bytes('JPEG', exif=exif_with_location(6))
+        image = self.stored_image(self.create_recipe(data_url(content)))
+        self.assertEqual(image.size, (30, 40))
+        self.assertFalse(image.getexif())
+
+    def test_multipart_png_metadata_removed(self):
+        upload = SimpleUploadedFile(
+            'photo.png', image_bytes('PNG', exif=exif_with_location()),
+            content_type='image/png')
+        image = self.stored_image(self.create_recipe(upload, 'multipart'))
+        self.assertEqual(image.format, 'PNG')
+        self.assertFalse(image.getexif())
+
+    def test_clean_image_not_rewritten(self):
+        self.assertIsNone(strip_metadata(image_bytes('JPEG')))
+
+
+class UserExpandTests(FoodgramTestCase):
+    def test_recipes_not_expanded_by_default(self):
+        response = self.client.get(f'/api/users/{self.users[0].pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('recipes', response.data)
+
+    def test_expand_recipes(self):
+        response = self.client.get(
+            '/api/users/?page=1&expand=recipes&recipes_limit=1')
+        self.assertEqual(response.status_code, 200)
+        for user in response.data['results']:
+            self.assertEqual(len(user['recipes']), 1)
+            self.assertEqual(set(user['recipes'][0]),
+                             {'id', 'name', 'image', 'cooking_time'})
+
+    def test_expand_queries_do_not_grow(self):
+        def queries(limit):
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(f'/api/users/?limit={limit}&expand=recipes')
+            return len(context.captured_queries)
+        self.assertEqual(queries(1), queries(3))
+
+    def test_unknown_expand(self):
+        response = self.client.get('/api/users/?expand=author')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('recipes', str(response.data['expand']))
+
+
+class SubscriptionTests(FoodgramTestCase):
+    def test_recipes_limit(self):
+        Subscribe.objects.create(user=self.users[0], author=self.users[1])
+        self.client.force_authenticate(self.users[0])
+        for limit, expected in (('1', 1), ('', 2), ('abc', 2)):
+            response = self.client.get(
+                f'/api/users/subscriptions/?recipes_limit={limit}')
+            self.assertEqual(response.status_code, 200)
+            author, = response.data['results']
+            self.assertEqual(len(author['recipes']), expected)
+            self.assertEqual(author['recipes_amount'], 2)
+
+
+class RecipeToggleTests(FoodgramTestCase):
+    MISSING = 10 ** 6
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.users[0]
+        self.client.force_authenticate(self.user)
+
+    def ids(self, recipes):
+        return [recipe.pk for recipe in recipes]
+
+    def favorites_counts(self):
+        return list(Recipe.objects.filter(pk__in=self.ids(self.recipes))
+                    .order_by('pk').values_list('favorites_count', flat=True))
+
+    def cart_totals(self):
+        return dict(ShoppingCartIngredient.objects.filter(user=self.user)
+                    .values_list('ingredient_id', 'amount'))
+
+    def expected_totals(self, recipes):
+        totals = {}
+        for item in RecipeIngredients.objects.filter(recipe__in=recipes):
+            totals[item.ingredient_id] = (
+                totals.get(item.ingredient_id, 0) + item.amount)
+        return totals
+
+    def test_toggle_twice(self):
+        recipe = self.recipes[0]
+        for action, model in (('favorite', Favorite),
+                              ('shopping_cart', ShoppingСart)):
+            url = f'/api/recipes/{recipe.pk}/{action}/'
+            self.assertEqual(self.client.post(url).status_code, 201)
+            response = self.client.post(url)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('errors', response.data)
+            self.assertEqual(model.objects.filter(
+                user=self.user, recipe=recipe).count(), 1)
+            self.assertEqual(self.client.delete(url).status_code, 204)
+            self.assertEqual(self.client.delete(url).status_code, 404)
+            self.assertFalse(model.objects.filter(user=self.user).exists())
+            self.assertEqual(self.client.post(
+                f'/api/recipes/{self.MISSING}/{action}/').status_code, 404)
+        self.assertEqual(self.favorites_counts(), [0] * self.recipes_count)
+        self.assertEqual(self.cart_totals(), {})
+
+    def test_bulk_favorite(self):
+        first, second, third, fourth = self.recipes[:4]
+        Favorite.objects.create(user=self.user, recipe=first)
+        response = self.client.post(
+            '/api/recipes/favorite/',
+            {'recipes': [*self.ids((first, second, third, second)),
+                         self.MISSING]},
+            format='json')
+        self.assertEqual(response.status_code, 201)
+        # Уже добавленный и несуществующий рецепты пропущены
+        self.assertCountEqual(response.data['added'],
+                              self.ids((second, third)))
+        self.assertEqual(self.favorites_counts(), [1, 1, 1, 0, 0, 0])
+        response = self.client.delete(
+            '/api/recipes/favorite/',
+            {'recipes': [*self.ids((second, fourth)), self.MISSING]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['removed'], [second.pk])
+        self.assertEqual(self.favorites_counts(), [1, 0, 1, 0, 0, 0])
+        self.assertCountEqual(
+            Favorite.objects.filter(user=self.user)
+            .values_list('recipe_id', flat=True), self.ids((first, third)))
+
+    def test_bulk_shopping_cart(self):
+        first, second, third = self.recipes[:3]
+        self.client.post(f'/api/recipes/{first.pk}/shopping_cart/')
+        response = self.client.post(
+            '/api/recipes/shopping_cart/',
+            {'recipes': [*self.ids((first, second, third)), self.MISSING]},
+            format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertCountEqual(response.data['added'],
+                              self.ids((second, third)))
+        self.assertEqual(self.cart_totals(),
+                         self.expected_totals((first, second, third)))
+        response = self.client.delete(
+            '/api/recipes/shopping_cart/',
+            {'recipes': self.ids((first, third, self.recipes[3]))},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual(response.data['removed'],
+                              self.ids((first, third)))
+        self.assertEqual(self.cart_totals(), self.expected_totals([second]))
+        # Итоги совпадают с пересчётом по корзине
+        call_command('rebuild_shopping_cart', check=True,
+                     stdout=StringIO(), stderr=StringIO())
+
+    def test_bulk_validation(self):
+        for body in ({}, {'recipes': []}, {'recipes': ['x']},
+                     {'recipes': [0]}):
+            response = self.client.post(
+                '/api/recipes/favorite/', body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+        self.assertFalse(Favorite.objects.exists())
+
+
+class BenchmarkTests(FoodgramTestCase):
+    def test_serializer_timer_counts_outer_data_once(self):
+        request = Request(APIRequestFactory().get('/api/users/'))
+        request.user = self.users[0]
+        with mock.patch('api.profiling.time') as clock:
+            clock.perf_counter.side_effect = range(100)
+            with SerializerTimer() as timer:
+                # get_recipes вызывает .data вложенного сериализатора
+                SubscriptionListSerializer(
+                    User.objects.prefetch_related(author_recipes()),
+                    many=True, context={'request': request}).data
+        # Учтён только внешний .data: два показания часов
+        self.assertEqual(timer.elapsed, 1)
+        self.assertEqual(clock.perf_counter.call_count, 2)
+
+    def test_bench_api_report(self):
+        output = os.path.join(MEDIA_ROOT, 'bench.json')
+        call_command('bench_api', repeat=2, warmup=0, output=output,
+                     stdout=StringIO())
+        with open(output, encoding='utf-8') as report_file:
+            routes = json.load(report_file)['routes']
+        self.assertTrue(routes)
+        for route in routes.values():
+            self.assertGreaterEqual(route['p50_ms'], route['sql_p50_ms'])
+            self.assertIn('serialize_p50_ms', route)
+
+
+class SerializeMetricsTests(FoodgramTestCase):
+    def serialize(self, users):
+        request = Request(APIRequestFactory().get('/api/users/'))
+        request.user = self.users[0]
+        return SubscriptionListSerializer(
+            users, many=True, context={'request': request}).data
+
+    def test_timer_is_per_thread(self):
+        # Пользователи загружены заранее: поток сериализует без БД
+        users = list(User.objects.prefetch_related(author_recipes()))
+        timers = []
+
+        def worker():
+            with SerializerTimer() as timer:
+                self.serialize(users)
+            timers.append(timer)
+
+        with SerializerTimer() as timer:
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        self.assertEqual(timer.calls, 0)
+        self.assertEqual(timer.elapsed, 0)
+        self.assertEqual(timers[0].calls, 1)
+
+    def test_nested_timer_reports_to_outer(self):
+        with SerializerTimer() as outer:
+            with SerializerTimer() as inner:
+                self.serialize(
+                    User.objects.prefetch_related(author_recipes()))
+        self.assertEqual(outer.calls, 1)
+        self.assertEqual(outer.elapsed, inner.elapsed)
+
+    @override_settings(SERVER_TIMING=True)
+    def test_serialize_time_per_action(self):
+        registry = MetricsRegistry()
+        with mock.patch('api.metrics.registry', registry):
+            response = self.client.get('/api/recipes/')
+            # Второй ответ из кэша: сериализации нет, в гистограмму
+            # serialize он не попадает
+            self.client.get('/api/recipes/')
+        self.assertRegex(response['Server-Timing'],
+                         r'serialize;dur=\d+\.\d')
+        report = registry.render()
+        self.assertIn('# TYPE foodgram_serialize_duration_seconds histogram',
+                      report)
+        self.assertIn('foodgram_serialize_duration_seconds_count'
+                      '{endpoint="RecipeViewSet.list"} 1', report)
+        self.assertIn('foodgram_request_duration_seconds_count'
+                      '{endpoint="RecipeViewSet.list"} 2', report)
+
+
+class ExportTests(FoodgramTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.users[0]
+        self.client.force_authenticate(self.user)
+        for recipe in self.recipes[:3]:
+            ShoppingСart.objects.create(user=self.user, recipe=recipe)
+
+    def download(self, export_format):
+        return self.client.get('/api/recipes/download_shopping_cart/'
+                               f'?format={export_format}')
+
+    def test_content_type_and_filename(self):
+        for export_format, content_type in (
+                ('txt', 'text/plain; charset=utf-8'),
+                ('csv', 'text/csv; charset=utf-8'),
+                ('pdf', 'application/pdf')):
+            response = self.download(export_format)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], content_type)
+            self.assertEqual(
+                response['Content-Disposition'],
+                f'attachment; filename=user0_items_to_buy.{export_format}')
+        self.assertTrue(
+            b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_unavailable_format(self):
+        with mock.patch('api.views.available_formats',
+                        return_value=['txt', 'csv']):
+            response = self.download('pdf')
+        self.assertEqual(response.status_code, 400)
+
+    def test_empty_cart(self):
+        ShoppingСart.objects.filter(user=self.user).delete()
+        self.assertEqual(self.download('txt').status_code, 400)
+
+    def test_csv_matches_cart_totals(self):
+        expected = {}
+        for row in RecipeIngredients.objects.filter(
+                recipe__in=self.recipes[:3]).select_related('ingredient'):
+            name = row.ingredient.name
+            expected[name] = expected.get(name, 0) + row.amount
+        response = self.download('csv')
+        body = b''.join(response.streaming_content).decode()
+        header, *rows = csv.reader(StringIO(body))
+        self.assertEqual(header,
+                         ['Ингредиент', 'Количество', 'Единица измерения'])
+        self.assertEqual({name: int(amount) for name, amount, _ in rows},
+                         expected)
+        self.assertEqual(len(rows), len(expected))
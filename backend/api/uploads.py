@@ -0,0 +1,101 @@
+import binascii
+import re
+from base64 import b64decode
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+from rest_framework import serializers
+
+DATA_URL = re.compile(r'data:image/[\w.+-]+;base64,')
+# Кратно 4, чтобы каждый кусок декодировался независимо
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'\s+')
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png', 'image/png'),
+    (b'GIF87a', 'gif', 'image/gif'),
+    (b'GIF89a', 'gif', 'image/gif'),
+)
+
+
+def sniff_image_type(head):
+    '''Тип картинки по сигнатуре в первых байтах, а не по заголовку
+    data URL или расширению'''
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp', 'image/webp'
+    for signature, extension, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return extension, content_type
+    raise serializers.ValidationError(
+        'Поддерживаются только картинки JPEG, PNG, GIF и WebP')
+
+
+def check_size(size):
+    if size > settings.IMAGE_UPLOAD_MAX_BYTES:
+        raise serializers.ValidationError(
+            'Картинка больше '
+            + filesizeformat(settings.IMAGE_UPLOAD_MAX_BYTES))
+
+
+def check_image(file, size):
+    '''Проверяет размер в байтах, формат и число пикселей,
+    читая только заголовок картинки'''
+    check_size(size)
+    file.seek(0)
+    image_type = sniff_image_type(file.read(16))
+    file.seek(0)
+    try:
+        width, height = Image.open(file).size
+    except Exception:
+        raise serializers.ValidationError('Файл повреждён')
+    file.seek(0)
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise serializers.ValidationError(
+            f'Картинка слишком большая: {width}x{height}')
+    return image_type
+
+
+def _base64_chunks(data, start):
+    tail = ''
+    for offset in range(start, len(data), CHUNK_SIZE):
+        chunk = tail + WHITESPACE.sub('', data[offset:offset + CHUNK_SIZE])
+        cut = len(chunk) - len(chunk) % 4
+        tail = chunk[cut:]
+        yield chunk[:cut]
+    if tail:
+        yield tail
+
+
+def decode_base64_image(data):
+    '''Декодирует data URL по частям во временный файл, который
+    уходит на диск при превышении FILE_UPLOAD_MAX_MEMORY_SIZE.
+    Метаданные убирает пул обработки картинок после сохранения'''
+    match = DATA_URL.match(data)
+    if match is None:
+        raise serializers.ValidationError(
+            'Ожидается картинка в формате data:image/...;base64,...')
+    start = match.end()
+    # Оценка до декодирования: base64 длиннее исходных байтов на треть
+    check_size((len(data) - start) * 3 // 4 - 2)
+    file = SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    size = 0
+    try:
+        for chunk in _base64_chunks(data, start):
+            try:
+                decoded = b64decode(chunk, validate=True)
+            except (binascii.Error, ValueError):
+                raise serializers.ValidationError(
+                    'Некорректные данные base64')
+            size += len(decoded)
+            check_size(size)
+            file.write(decoded)
+        extension, content_type = check_image(file, size)
+    except Exception:
+        file.close()
+        raise
+    return UploadedFile(file, name=f'image.{extension}',
+                        content_type=content_type, size=size)
@@ -1,8 +1,10 @@
 from datetime import date
 
-from django.db import IntegrityError
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.db.models import (BooleanField, OuterRef, Prefetch, Subquery,
+                              Value)
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
 
@@ -10,29 +12,66 @@ from rest_framework import status, viewsets, mixins
 from rest_framework.decorators import action
 from rest_framework.permissions import (AllowAny, IsAuthenticated, 
                                         IsAuthenticatedOrReadOnly, SAFE_METHODS)
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from .cache import CachedResponseMixin, CatalogCacheMixin
+from .exports import (EXPORT_FORMATS, available_formats,
+                      shopping_list_items, spool)
+from .fieldsets import SparseFieldsetMixin
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import CustomPagination
+from .ingredient_index import ingredient_index
+from .pagination import (CustomPagination, KeysetPaginationMixin,
+                         RecipeKeysetPagination, UserKeysetPagination)
 from .permissions import IsAuthorOrReadOnly
+from .renderers import (CsvExportRenderer, PdfExportRenderer,
+                        TxtExportRenderer)
 from .serializers import (UserListSerializer, SignUpSerializer,
                           SubscriptionListSerializer, SubscribeSerializer,
                           TagListSerializer, IngredientsListSerializer,
                           RecipeListSerializer, PasswordSerializer,
-                          RecipeCreateSerializer, FavouriteRecipeSerializer,)
+                          RecipeCreateSerializer, FavouriteRecipeSerializer,
+                          RecipeIdsSerializer,)
 
+from recipe.catalog import catalog_version
 from recipe.models import (Recipe, Ingredient, Tag, Favorite,
-                           ShoppingСart, RecipeIngredients,)
+                           ShoppingСart,)
+from recipe.toggles import add_relations, remove_relations
 from users.models import User, Subscribe
 
 
-class UserViewSet(mixins.CreateModelMixin,
+def author_recipes(recipes_limit=None):
+    '''Рецепты авторов в limited_recipes, не больше recipes_limit
+    на автора'''
+    recipes = Recipe.objects.all()
+    if recipes_limit and recipes_limit.isdigit():
+        # Первые N рецептов каждого автора отбираются в самом SQL
+        recipes = recipes.filter(pk__in=Subquery(
+            Recipe.objects
+            .filter(author=OuterRef('author'))
+            .values('pk')[:int(recipes_limit)]))
+    return Prefetch('recipe', queryset=recipes, to_attr='limited_recipes')
+
+
+class UserViewSet(SparseFieldsetMixin,
+                  KeysetPaginationMixin,
+                  mixins.CreateModelMixin,
                   mixins.ListModelMixin,
                   mixins.RetrieveModelMixin,
                   viewsets.GenericViewSet):
     queryset = User.objects.all()
     pagination_class = CustomPagination
+    keyset_pagination_class = UserKeysetPagination
     permission_classes = (AllowAny,)
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        queryset = self.sparse_queryset(super().get_queryset())
+        if self.is_expanded('recipes'):
+            queryset = queryset.prefetch_related(author_recipes(
+                self.request.query_params.get('recipes_limit')))
+        return queryset
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
@@ -59,7 +98,14 @@ class UserViewSet(mixins.CreateModelMixin,
             permission_classes=(IsAuthenticated,),
             pagination_class=CustomPagination)
     def subscriptions(self, request):
-        queryset = User.objects.filter(subscribing__user=request.user)
+        queryset = (
+            User.objects
+            .filter(subscribing__user=request.user)
+            .annotate(is_subscribed=Value(True, BooleanField()))
+            .prefetch_related(author_recipes(
+                request.query_params.get('recipes_limit')))
+            .order_by('id')
+        )
         page = self.paginate_queryset(queryset)
         serializer = SubscriptionListSerializer(page, many=True,
                                                 context={'request': request})
@@ -69,41 +115,67 @@ class UserViewSet(mixins.CreateModelMixin,
             permission_classes=(IsAuthenticated,))
     def subscribe(self, request, **kwargs):
         user = self.request.user
-        author = get_object_or_404(User, id=kwargs['pk'])
         if request.method == 'POST':
+            author = get_object_or_404(User, id=kwargs['pk'])
             serializer = SubscribeSerializer(author, data=request.data,
                                              context={"request": request})
             serializer.is_valid(raise_exception=True)
-            Subscribe.objects.create(author=author, user=user)
+            if not add_relations(Subscribe, user.id, [author.id]):
+                return Response(
+                    {'errors': 'Вы уже подписаны на этого пользователя!'},
+                    status=status.HTTP_400_BAD_REQUEST)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         if request.method == 'DELETE':
-            get_object_or_404(Subscribe, user=request.user, author=author).delete()
+            if not remove_relations(Subscribe, user.id, [int(kwargs['pk'])]):
+                raise Http404
             return Response({'detail': 'Вы отписались от пользователя'},
                             status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class TagViewSet(mixins.ListModelMixin,
+class TagViewSet(CatalogCacheMixin,
+                 mixins.ListModelMixin,
                  mixins.RetrieveModelMixin,
                  viewsets.GenericViewSet):
     queryset = Tag.objects.all()
+    cache_namespace = 'tags'
     pagination_class = None
     permission_classes = (AllowAny,)
     serializer_class = TagListSerializer
 
 
-class IngredientViewSet(mixins.ListModelMixin,
+class IngredientViewSet(CatalogCacheMixin,
+                        mixins.ListModelMixin,
                         mixins.RetrieveModelMixin,
                         viewsets.GenericViewSet):
     queryset = Ingredient.objects.all()
+    cache_namespace = 'ingredients'
     permission_classes = (AllowAny,)
     serializer_class = IngredientsListSerializer
     pagination_class = None
     filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        '''Автодополнение обслуживается индексом в памяти процесса.
+        Версия справочника читается один раз: для ETag и индекса'''
+        name = request.query_params.get('name')
+        if not name or not settings.INGREDIENT_SEARCH_INDEX:
+            return super().list(request, *args, **kwargs)
+        version = catalog_version(self.cache_namespace)
+        return self.etag_response(
+            request, self.version_etag(request, version),
+            lambda: ingredient_index.search(name, version=version))
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(CachedResponseMixin, SparseFieldsetMixin,
+                    KeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
+    cache_namespace = 'recipes'
+    cache_actions = ('list', 'retrieve', 'popular')
+    keyset_pagination_class = RecipeKeysetPagination
+    lookup_value_regex = r'\d+'
+    sparse_actions = ('list', 'retrieve', 'popular', 'following')
+    required_columns = ('id', 'pub_date')
     permission_classes = (
         IsAuthorOrReadOnly,
         IsAuthenticatedOrReadOnly
@@ -111,74 +183,144 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     pagination_class = CustomPagination
+    # multipart позволяет передать картинку файлом, без base64 в JSON
+    parser_classes = (JSONParser, MultiPartParser)
     http_method_names = ['get', 'post', 'patch', 'create', 'delete']
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'popular':
+            # Рейтинг заранее рассчитан командой refresh_feeds
+            queryset = queryset.filter(popularity__isnull=False).order_by(
+                '-popularity__score', '-popularity__recipe')
+        elif self.action == 'following':
+            queryset = queryset.filter(
+                feed_entries__user=self.request.user).order_by(
+                    '-feed_entries__pub_date', '-feed_entries__recipe')
+        if self.action in self.sparse_actions:
+            queryset = self.with_requested_related(
+                self.sparse_queryset(queryset))
+        return queryset
+
+    def with_requested_related(self, queryset):
+        '''Как Recipe.objects.with_related, но только для связей,
+        которые попадут в ответ: карточке ленты не нужны ни теги,
+        ни ингредиенты'''
+        if self.is_expanded('author'):
+            queryset = queryset.select_related('author')
+        if self.is_requested('tags'):
+            queryset = queryset.prefetch_related(
+                'tags' if self.is_expanded('tags')
+                else Prefetch('tags', queryset=Tag.objects.only('id')))
+        if self.is_requested('ingredients'):
+            queryset = queryset.prefetch_related(
+                'recipe_ingredient__ingredient'
+                if self.is_expanded('ingredients')
+                else 'recipe_ingredient')
+        return queryset
+
+    def use_keyset_pagination(self):
+        # Поиск и популярные сортируют не по дате
+        return (super().use_keyset_pagination()
+                and self.action == 'list'
+                and not self.request.query_params.get('search')
+                and not self.request.query_params.get('popular'))
+
+    def is_cacheable(self, request):
+        '''Ответы анонимам одинаковы для всех посетителей'''
+        return (super().is_cacheable(request)
+                and not request.user.is_authenticated)
+
     def get_serializer_class(self):
-        if self.action in ('list', 'retrieve'):
+        if self.action in ('list', 'retrieve', 'popular', 'following'):
             return RecipeListSerializer
         return RecipeCreateSerializer
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['image_rendition'] = (
+            'detail' if self.action == 'retrieve' else 'card')
+        return context
+
+    @action(detail=False, methods=['get'])
+    def popular(self, request):
+        '''Рецепты по рейтингу избранного и корзин за последнее время'''
+        return self.list(request)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=(IsAuthenticated,))
+    def following(self, request):
+        '''Рецепты авторов, на которых подписан пользователь'''
+        return self.list(request)
+
     def perform_create(self, serializer):
         '''Получение объекта - автор рецепта'''
         serializer.save(author=self.request.user)
 
+    def toggle_recipe(self, request, model, pk, exists_error,
+                      removed_detail):
+        '''Одна строка связи добавляется или удаляется одним
+        запросом; повторный клик не приводит к ошибке БД'''
+        if request.method == 'POST':
+            recipe = get_object_or_404(Recipe, id=pk)
+            if not add_relations(model, request.user.id, [recipe.id]):
+                return Response({'errors': exists_error},
+                                status=status.HTTP_400_BAD_REQUEST)
+            serializer = FavouriteRecipeSerializer(
+                recipe, context=self.get_serializer_context())
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        if not remove_relations(model, request.user.id, [int(pk)]):
+            raise Http404
+        return Response({'detail': removed_detail},
+                        status=status.HTTP_204_NO_CONTENT)
+
+    def toggle_recipes(self, request, model):
+        '''Массовое добавление или удаление: один INSERT
+        или DELETE на весь список рецептов'''
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            added = add_relations(model, request.user.id, recipe_ids)
+            return Response({'added': added},
+                            status=status.HTTP_201_CREATED)
+        removed = remove_relations(model, request.user.id, recipe_ids)
+        return Response({'removed': removed}, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=(IsAuthenticated,))
     def favorite(self, request, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs['pk'])
-        if request.method == 'POST':
-            try:
-                Favorite.objects.create(user=request.user, recipe=recipe)
-            except IntegrityError:
-                return Response(
-                    {'errors':
-                     'Вы уже добавляли этот рецепт в список покупок!'},
-                    status=status.HTTP_400_BAD_REQUEST)
-            serializer = FavouriteRecipeSerializer(recipe)
-            return Response(
-                serializer.data,
-                status=status.HTTP_201_CREATED,
-            )
-
-        if request.method == 'DELETE':
-            get_object_or_404(Favorite, user=request.user,
-                              recipe=recipe).delete()
-            return Response(
-                {'detail': 'Вы успешно удалили рецепт из избранного!'},
-                status=status.HTTP_204_NO_CONTENT)
-        return Response({'detail': 'Проверьте метод'},
-                        status=status.HTTP_400_BAD_REQUEST)
+        return self.toggle_recipe(
+            request, Favorite, kwargs['pk'],
+            'Вы уже добавляли этот рецепт в избранное!',
+            'Вы успешно удалили рецепт из избранного!')
 
     @action(detail=True, methods=['post', 'delete'],
-            permission_classes=(IsAuthenticated,),
-            pagination_class=CustomPagination)
+            permission_classes=(IsAuthenticated,))
     def shopping_cart(self, request, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs['pk'])
+        return self.toggle_recipe(
+            request, ShoppingСart, kwargs['pk'],
+            'Вы уже добавляли этот рецепт в список покупок!',
+            'Вы успешно удалили рецепт из списка покупок!')
 
-        if request.method == 'POST':
-            serializer = FavouriteRecipeSerializer(recipe, data=request.data,
-                                          context={"request": request})
-            serializer.is_valid(raise_exception=True)
-            if not ShoppingСart.objects.filter(user=request.user,
-                                               recipe=recipe).exists():
-                ShoppingСart.objects.create(user=request.user, recipe=recipe)
-                return Response(serializer.data,
-                                status=status.HTTP_201_CREATED)
-            return Response(
-                {'errors': 'Вы уже добавляли этот рецепт в список покупок!'},
-                status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=(IsAuthenticated,),
+            url_path='favorite', url_name='favorite-bulk')
+    def favorite_bulk(self, request):
+        '''{"recipes": [id, ...]} в избранное или из него'''
+        return self.toggle_recipes(request, Favorite)
 
-        if request.method == 'DELETE':
-            get_object_or_404(ShoppingСart, user=request.user,
-                              recipe=recipe).delete()
-            return Response(
-                {'detail': 'Вы успешно удалили рецепт из списка покупок!'},
-                status=status.HTTP_204_NO_CONTENT)
-        return Response({'detail': 'Проверьте метод'},
-                        status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=(IsAuthenticated,),
+            url_path='shopping_cart', url_name='shopping-cart-bulk')
+    def shopping_cart_bulk(self, request):
+        '''Например, весь план питания в корзину одним запросом'''
+        return self.toggle_recipes(request, ShoppingСart)
 
     @action(detail=False,
-            permission_classes=(IsAuthenticated,))
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=(JSONRenderer, TxtExportRenderer,
+                              CsvExportRenderer, PdfExportRenderer))
     def download_shopping_cart(self, request):
         user = request.user
         current_date = date.today()
@@ -187,25 +329,19 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 {'detail': 'Ваш список покупок пуст!'},
                 status=status.HTTP_400_BAD_REQUEST)
 
-        ingredients = (
-            RecipeIngredients.objects
-            .filter(recipe__shopping_cart_recipe__user=user)
-            .values('ingredient')
-            .annotate(total=Sum('amount'))
-            .values_list('ingredient__name', 'total',
-                         'ingredient__measurement_unit')
-        )
-        items_to_buy = (
-            f'Дата: {current_date.strftime("%d/%m/%Y")}\n'
-        )
-        i = 1
-        for ingredient in ingredients:
-            items_to_buy += ''.join(
-                '{}. {} - {} {}.\n'.format(i, *ingredient))
-            i += 1
-
-        filename = f'{user.username}_items_to_buy.txt'
-        response = HttpResponse(items_to_buy, content_type='text/plain')
+        export_format = request.query_params.get('format', 'txt')
+        if export_format not in available_formats():
+            return Response(
+                {'detail': 'Формат {} недоступен'.format(export_format)},
+                status=status.HTTP_400_BAD_REQUEST)
+        export, content_type = EXPORT_FORMATS[export_format]
+
+        filename = f'{user.username}_items_to_buy.{export_format}'
+        chunks = export(shopping_list_items(user), current_date)
+        if isinstance(request._request, ASGIRequest):
+            response = FileResponse(spool(chunks), content_type=content_type)
+        else:
+            response = StreamingHttpResponse(chunks, content_type=content_type)
         response['Content-Disposition'] = f'attachment; filename={filename}'
 
-        return response
\ No newline at end of file
+        return response
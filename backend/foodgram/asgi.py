@@ -1,7 +1,15 @@
 import os
 
+from asgiref.sync import ThreadSensitiveContext
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    # Django 3.2 выполняет синхронные view в одном общем потоке;
+    # отдельный контекст даёт каждому запросу свой поток
+    async with ThreadSensitiveContext():
+        await django_application(scope, receive, send)
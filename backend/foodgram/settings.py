@@ -25,6 +25,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     'rest_framework',
     'rest_framework.authtoken',
@@ -34,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -42,6 +45,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -85,6 +89,27 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+
+API_CACHE_TIMEOUT = int(os.getenv('API_CACHE_TIMEOUT', default=300))
+# Срок жизни версий пространств имён кэша API. Локальный кэш у каждого
+# воркера свой, и сброс виден только в записавшем процессе: остальные
+# отдают старые ответы не дольше этого срока. С общим кэшем
+# (CACHE_BACKEND=...PyMemcacheCache) можно задать 0 — без срока
+API_CACHE_VERSION_TIMEOUT = int(
+    os.getenv('API_CACHE_VERSION_TIMEOUT', default=15))
+
+INGREDIENT_SEARCH_INDEX = True
+INGREDIENT_SEARCH_LIMIT = 50
+INGREDIENT_INDEX_MAX_AGE = 600
+
 AUTH_USER_MODEL = 'users.User'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -124,8 +149,12 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny', 
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -142,6 +171,69 @@ DJOSER = {
     'LOGIN_FIELD': 'email',
 }
 
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+# Обработка картинок рецептов в пуле потоков; 0 — синхронно
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_UPLOAD_MAX_BYTES = int(
+    os.getenv('IMAGE_UPLOAD_MAX_BYTES', default=10 * 1024 * 1024))
+# Уменьшенные копии: карточка в ленте, страница рецепта
+IMAGE_RENDITIONS = {
+    'card': (480, 320),
+    'detail': (1200, 800),
+}
+IMAGE_RENDITION_FORMAT = os.getenv('IMAGE_RENDITION_FORMAT', default='webp')
+
+# Лента популярного: вес события падает вдвое за POPULAR_HALF_LIFE_DAYS
+POPULAR_HALF_LIFE_DAYS = 7
+POPULAR_FAVORITE_WEIGHT = 1.0
+POPULAR_CART_WEIGHT = 0.5
+# Сколько последних рецептов автора попадает в ленту нового подписчика
+FOLLOWING_FEED_DEPTH = 200
+# refresh_feeds не берёт события моложе стольких секунд: транзакции,
+# начатые до запуска, успевают зафиксироваться. Должно быть больше
+# самой долгой записывающей транзакции
+FEED_WATERMARK_OVERLAP = int(
+    os.getenv('FEED_WATERMARK_OVERLAP', default=60))
+# Предел рецептов в одном запросе массового добавления в избранное
+# или корзину
+BULK_RECIPES_MAX = 500
+
+# Метрики эндпоинтов: /api/metrics/ и заголовок Server-Timing
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+METRICS_DUPLICATE_QUERIES = 3
+SERVER_TIMING = os.getenv('SERVER_TIMING', default=str(DEBUG)) == 'True'
+
+# Профилирование запросов персонала (X-Profile: 1); пусто — выключено
+PROFILING_DIR = os.getenv('PROFILING_DIR', default='')
+PROFILING_RATE = 6
+PROFILING_MAX_BYTES = 100 * 1024 * 1024
+
+# Кэш токенов: отозванный токен перестаёт действовать не позже чем
+# через TOKEN_REVOCATION_WINDOW секунд; TOKEN_CACHE_ALIAS — общий кэш
+TOKEN_REVOCATION_WINDOW = int(
+    os.getenv('TOKEN_REVOCATION_WINDOW', default=60))
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_ALIAS = os.getenv('TOKEN_CACHE_ALIAS', default='')
+
+# Избранное, корзина и подписки пользователя для флагов в ответах API.
+# Без RELATIONS_CACHE_ALIAS наборы читаются заново в каждом запросе
+RELATIONS_CACHE_ALIAS = os.getenv('RELATIONS_CACHE_ALIAS', default='')
+RELATIONS_CACHE_TIMEOUT = 300
+
+# Сколько дней хранятся сведения об удалённых записях справочников
+# (команда prune_catalog_tombstones)
+CATALOG_TOMBSTONE_DAYS = int(
+    os.getenv('CATALOG_TOMBSTONE_DAYS', default=90))
+
+# Сжатие ответов API (brotli, если установлен, иначе gzip)
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', default=1024))
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
 ] 
@@ -0,0 +1,30 @@
+import os
+
+# sync    — процесс на запрос, медленный клиент занимает воркер целиком;
+# gthread — потоки внутри процесса, подходит для загрузок и выгрузок;
+# asgi    — uvicorn: тело запроса и ответ передаёт цикл событий
+WORKER_MODE = os.getenv('GUNICORN_WORKER_MODE', 'gthread')
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'asgi': 'uvicorn.workers.UvicornWorker',
+}
+
+wsgi_app = ('foodgram.asgi:application' if WORKER_MODE == 'asgi'
+            else 'foodgram.wsgi:application')
+worker_class = WORKER_CLASSES[WORKER_MODE]
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+# Бюджет соединений Postgres: CONN_MAX_AGE не задан, поэтому каждый
+# поток держит соединение только на время запроса, но в пике их
+# workers * (threads + IMAGE_WORKERS) на контейнер плюс manage.py
+# и cron. Сумма по всем контейнерам backend должна оставаться ниже
+# max_connections (по умолчанию 100, из них 3 резервные): при 2 * (4 + 2)
+# это 12 соединений. Воркеры добавляйте через GUNICORN_WORKERS, сверяясь
+# с этим расчётом, а не от числа ядер хоста
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+keepalive = 5
+max_requests = 2000
+max_requests_jitter = 200
+accesslog = '-'
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.contrib.admin import display
 from .models import (Recipe, Ingredient, Tag, Favorite,
-                     ShoppingСart, RecipeIngredients,)
+                     ShoppingСart, RecipeIngredients,
+                     ShoppingCartIngredient,)
 
 
 @admin.register(Ingredient)
@@ -34,10 +35,20 @@ class RecipeAdmin(admin.ModelAdmin):
     model = Recipe
     inlines = [IngredientInline,]
 
+    def save_related(self, request, form, formsets, change):
+        old_amounts = dict(form.instance.recipe_ingredient.values_list(
+            'ingredient_id', 'amount')) if change else {}
+        super().save_related(request, form, formsets, change)
+        ShoppingCartIngredient.objects.recipe_changed(
+            form.instance, old_amounts,
+            dict(form.instance.recipe_ingredient.values_list(
+                'ingredient_id', 'amount')))
+        Recipe.objects.filter(pk=form.instance.pk).update_search_vector()
+
     @display(description = 'Добавлено в избранное',
-             empty_value='Не добавлено в избранное')
+             ordering='favorites_count')
     def favorite_amount(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
+        return obj.favorites_count
 
 
 @admin.register(Favorite)
@@ -60,3 +71,11 @@ class RecipeIngredientsAdmin(admin.ModelAdmin):
     list_display = ('recipe', 'ingredient', 'amount')
     empty_value_display = '-пусто-'
     model = RecipeIngredients
+
+
+@admin.register(ShoppingCartIngredient)
+class ShoppingCartIngredientAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount')
+    list_filter = ('user',)
+    empty_value_display = '-пусто-'
+    model = ShoppingCartIngredient
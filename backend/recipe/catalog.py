@@ -0,0 +1,83 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import CatalogTombstone, CatalogVersion, Ingredient, Tag
+
+# Справочник: (модель, поля в ответе ?since=)
+CATALOGS = {
+    'ingredients': (Ingredient, ('id', 'name', 'measurement_unit')),
+    'tags': (Tag, ('id', 'name', 'color', 'slug')),
+}
+
+
+def _counter(name):
+    return (CatalogVersion.objects.filter(name=name)
+            .values_list('value', 'pruned').first()) or (0, 0)
+
+
+def catalog_version(name):
+    '''Текущая версия справочника: один запрос по первичному ключу.
+    Не кэшируется в памяти процесса — иначе другие воркеры
+    отдавали бы 304 на устаревший справочник'''
+    return _counter(name)[0]
+
+
+def record_deletion(name, object_id):
+    '''Вызывается внутри транзакции удаления'''
+    CatalogTombstone.objects.create(
+        catalog=name, object_id=object_id,
+        version=CatalogVersion.objects.next(name))
+
+
+def prune_tombstones(days=None):
+    '''Удаляет сведения об удалённых записях старше days дней.
+    Клиенты, не синхронизировавшиеся дольше, получат полный снимок'''
+    if days is None:
+        days = settings.CATALOG_TOMBSTONE_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    pruned = 0
+    for name in CATALOGS:
+        with transaction.atomic():
+            old = CatalogTombstone.objects.filter(
+                catalog=name, deleted_at__lt=cutoff)
+            latest = old.aggregate(latest=Max('version'))['latest']
+            if latest is None:
+                continue
+            CatalogVersion.objects.get_or_create(name=name)
+            CatalogVersion.objects.filter(
+                name=name, pruned__lt=latest).update(pruned=latest)
+            pruned += CatalogTombstone.objects.filter(
+                catalog=name, version__lte=latest).delete()[0]
+    return pruned
+
+
+def catalog_delta(name, since=0):
+    '''Изменённые и удалённые после версии since записи
+    в колоночном виде: {"id": [...], "name": [...], ...}.
+    since=0, версия из будущего или старше срока хранения
+    удалённых записей — полный снимок справочника'''
+    model, fields = CATALOGS[name]
+    version, pruned = _counter(name)
+    full = not since or since > version or since < pruned
+    rows = model.objects.order_by('pk')
+    deleted = []
+    if not full:
+        # Верхняя граница: изменения, зафиксированные после
+        # чтения версии, придут в следующей синхронизации
+        rows = rows.filter(version__gt=since, version__lte=version)
+        deleted = list(
+            CatalogTombstone.objects
+            .filter(catalog=name, version__gt=since, version__lte=version)
+            .order_by('version').values_list('object_id', flat=True))
+    columns = list(zip(*rows.values_list(*fields))) or [()] * len(fields)
+    return {
+        'version': version,
+        'full': full,
+        'changed': {field: list(column)
+                    for field, column in zip(fields, columns)},
+        'deleted': deleted,
+    }
@@ -0,0 +1,52 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from users.models import Subscribe, User
+from .models import Favorite, Recipe
+
+BATCH_SIZE = 1000
+# Счётчик: (модель, поле, связанная модель, поле связи)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscribe, 'author'),
+)
+
+
+def change_counter(model, field, pk, delta):
+    '''Атомарное изменение счётчика одним UPDATE без чтения строки'''
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def change_counters(model, field, pks, delta):
+    '''То же для нескольких строк одним UPDATE'''
+    model.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+
+def actual_count(related_model, related_field):
+    return Coalesce(Subquery(
+        related_model.objects
+        .filter(**{related_field: OuterRef('pk')})
+        .order_by()
+        .values(related_field)
+        .annotate(total=Count('pk'))
+        .values('total')), Value(0))
+
+
+def reconcile_counters(fix=True):
+    '''Сверяет счётчики с фактическим числом связанных строк
+    и при fix=True исправляет расхождения. Возвращает число
+    расхождений по каждому счётчику'''
+    drift = {}
+    for model, field, related_model, related_field in COUNTERS:
+        wrong = list(
+            model.objects
+            .annotate(actual=actual_count(related_model, related_field))
+            .exclude(**{field: F('actual')})
+            .values_list('pk', flat=True))
+        drift[f'{model._meta.model_name}.{field}'] = len(wrong)
+        for start in range(0, len(wrong) if fix else 0, BATCH_SIZE):
+            model.objects.filter(
+                pk__in=wrong[start:start + BATCH_SIZE]
+            ).update(**{field: actual_count(related_model, related_field)})
+    return drift
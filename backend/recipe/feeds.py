@@ -0,0 +1,173 @@
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import groupby, islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import Subscribe
+from .models import (Favorite, FeedEntry, FeedWatermark, PopularRecipe,
+                     Recipe, ShoppingСart)
+
+EPOCH = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def decay_rate():
+    return math.log(2) / (settings.POPULAR_HALF_LIFE_DAYS * 86400)
+
+
+def event_score(created, weight):
+    '''Логарифм веса события, растущего вдвое за каждый период
+    полураспада. Сравнивать такие веса — то же, что сравнивать
+    экспоненциально затухающие суммы на любой момент времени,
+    но без пересчёта старых значений'''
+    return (decay_rate() * (created - EPOCH).total_seconds()
+            + math.log(weight))
+
+
+def log_add(left, right):
+    if left is None:
+        return right
+    high, low = max(left, right), min(left, right)
+    return high + math.log1p(math.exp(low - high))
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def scan_until(overlap=None):
+    '''Верхняя граница сканирования. Отметка времени события ставится
+    до фиксации транзакции: события моложе overlap секунд
+    могут быть ещё не видны и ждут следующего запуска'''
+    if overlap is None:
+        overlap = settings.FEED_WATERMARK_OVERLAP
+    return timezone.now() - timedelta(seconds=overlap)
+
+
+def get_watermark(name):
+    watermark = FeedWatermark.objects.filter(name=name).first()
+    return watermark.value if watermark else None
+
+
+def set_watermark(name, value):
+    FeedWatermark.objects.update_or_create(
+        name=name, defaults={'value': value})
+
+
+def _events(model, since, until):
+    events = model.objects.filter(created__lte=until)
+    if since is not None:
+        events = events.filter(created__gt=since)
+    return (events.order_by()
+            .values_list('recipe_id', 'created')
+            .iterator(chunk_size=2000))
+
+
+def _merge_scores(deltas):
+    existing = PopularRecipe.objects.in_bulk(deltas)
+    for recipe_id, popularity in existing.items():
+        popularity.score = log_add(popularity.score, deltas[recipe_id])
+    PopularRecipe.objects.bulk_update(existing.values(), ['score'])
+    # ignore_conflicts: рецепт могли удалить, пока шёл пересчёт
+    PopularRecipe.objects.bulk_create(
+        (PopularRecipe(recipe_id=recipe_id, score=score)
+         for recipe_id, score in deltas.items()
+         if recipe_id not in existing),
+        ignore_conflicts=True)
+
+
+def refresh_popular(full=False, batch_size=5000, overlap=None):
+    '''Добавляет к рейтингу события избранного и корзин после
+    отметки прошлого пересчёта. Удаления из избранного учитывает
+    только полный пересчёт'''
+    until = scan_until(overlap)
+    since = None if full else get_watermark('popular')
+    processed = 0
+    with transaction.atomic():
+        if since is None:
+            PopularRecipe.objects.all().delete()
+        for model, weight in ((Favorite, settings.POPULAR_FAVORITE_WEIGHT),
+                              (ShoppingСart, settings.POPULAR_CART_WEIGHT)):
+            for batch in chunks(_events(model, since, until), batch_size):
+                deltas = {}
+                for recipe_id, created in batch:
+                    deltas[recipe_id] = log_add(
+                        deltas.get(recipe_id), event_score(created, weight))
+                _merge_scores(deltas)
+                processed += len(batch)
+        set_watermark('popular', until)
+    return processed
+
+
+def _fan_out(pairs, batch_size):
+    '''Пары (подписчик, рецепт) в ленту подписок'''
+    created = 0
+    for batch in chunks(pairs, batch_size):
+        FeedEntry.objects.bulk_create(
+            (FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                       author_id=author_id, pub_date=pub_date)
+             for user_id, recipe_id, author_id, pub_date in batch),
+            ignore_conflicts=True)
+        created += len(batch)
+    return created
+
+
+def _new_recipes_pairs(since, until):
+    recipes = Recipe.objects.filter(pub_date__lte=until)
+    if since is not None:
+        recipes = recipes.filter(pub_date__gt=since)
+    recipes = (recipes.order_by('author_id', 'pub_date')
+               .values_list('author_id', 'pk', 'pub_date')
+               .iterator(chunk_size=2000))
+    for author_id, author_recipes in groupby(recipes, lambda row: row[0]):
+        author_recipes = list(author_recipes)[
+            -settings.FOLLOWING_FEED_DEPTH:]
+        subscribers = (Subscribe.objects.filter(author_id=author_id)
+                       .values_list('user_id', flat=True)
+                       .iterator(chunk_size=2000))
+        for user_id in subscribers:
+            for _, recipe_id, pub_date in author_recipes:
+                yield user_id, recipe_id, author_id, pub_date
+
+
+def _new_subscriptions_pairs(since, until):
+    subscriptions = Subscribe.objects.filter(created__lte=until)
+    if since is not None:
+        subscriptions = subscriptions.filter(created__gt=since)
+    subscriptions = (subscriptions.order_by('author_id')
+                     .values_list('author_id', 'user_id')
+                     .iterator(chunk_size=2000))
+    for author_id, rows in groupby(subscriptions, lambda row: row[0]):
+        recipes = list(
+            Recipe.objects.filter(author_id=author_id)
+            .order_by('-pub_date')
+            .values_list('pk', 'pub_date')[:settings.FOLLOWING_FEED_DEPTH])
+        for _, user_id in rows:
+            for recipe_id, pub_date in recipes:
+                yield user_id, recipe_id, author_id, pub_date
+
+
+def refresh_following(full=False, batch_size=5000, overlap=None):
+    '''Раскладывает новые рецепты по лентам подписчиков и добавляет
+    в ленты рецепты авторов из новых подписок'''
+    until = scan_until(overlap)
+    since = None if full else get_watermark('following')
+    with transaction.atomic():
+        if since is None:
+            FeedEntry.objects.all().delete()
+            created = _fan_out(
+                _new_subscriptions_pairs(None, until), batch_size)
+        else:
+            created = (
+                _fan_out(_new_recipes_pairs(since, until), batch_size)
+                + _fan_out(_new_subscriptions_pairs(since, until),
+                           batch_size))
+        set_watermark('following', until)
+    return created
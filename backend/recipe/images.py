@@ -0,0 +1,193 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS_DIR = 'recipe/renditions'
+# Параметры сохранения; метаданные (EXIF, ICC) не передаются,
+# поэтому в копии они не попадают
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True,
+                      'progressive': True}),
+}
+
+# Метаданные, которые не должны попасть в отдаваемый оригинал
+METADATA_KEYS = {'exif', 'xmp', 'XML:com.adobe.xmp', 'comment'}
+ORIENTATION = 0x0112
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='image-renditions')
+    return _executor
+
+
+def rendition_path(recipe_id, source, rendition, extension):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return (f'{RENDITIONS_DIR}/{recipe_id}/'
+            f'{stem}_{rendition}.{extension}')
+
+
+def read_image(source):
+    '''Читает и проверяет картинку; verify() портит объект,
+    поэтому данные открываются заново'''
+    with default_storage.open(source, 'rb') as file:
+        data = file.read()
+    with Image.open(io.BytesIO(data)) as image:
+        image.verify()
+    image = Image.open(io.BytesIO(data))
+    if image.width * image.height > settings.IMAGE_MAX_PIXELS:
+        raise ValueError(f'Image is too large: {image.size}')
+    return data
+
+
+def has_metadata(image):
+    return bool(image.getexif() or METADATA_KEYS & image.info.keys()
+                or getattr(image, 'text', None))
+
+
+def strip_metadata(data):
+    '''Оригинал без EXIF (с координатами съёмки), XMP и комментариев:
+    он отдаётся из /media/ как есть. Поворот из EXIF применяется
+    к пикселям, ICC-профиль остаётся. None, если убирать нечего'''
+    image = Image.open(io.BytesIO(data))
+    if not has_metadata(image):
+        return None
+    image_format = image.format
+    options = {'icc_profile': image.info.get('icc_profile')}
+    if getattr(image, 'is_animated', False):
+        options['save_all'] = True
+    elif image.getexif().get(ORIENTATION, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+    elif image_format == 'JPEG':
+        # Те же таблицы квантования: без повторной потери качества
+        options['quality'] = 'keep'
+    if image_format in ('JPEG', 'WEBP'):
+        options.setdefault('quality', 90)
+    buffer = io.BytesIO()
+    image.save(buffer, image_format,
+               **{name: value for name, value in options.items()
+                  if value is not None})
+    return buffer.getvalue()
+
+
+def replace_source(source, data):
+    '''Перезаписывает оригинал под тем же именем, на которое
+    ссылается Recipe.image'''
+    default_storage.delete(source)
+    saved = default_storage.save(source, ContentFile(data))
+    if saved != source:
+        default_storage.delete(saved)
+        raise ValueError(f'Cannot overwrite {source}')
+
+
+def open_image(data):
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info
+                              else 'RGB')
+    return image
+
+
+def encode(image, extension):
+    image_format, options = FORMATS[extension]
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def build_renditions(recipe_id, source):
+    '''Убирает метаданные из оригинала, сохраняет уменьшенные копии
+    картинки во всех форматах и возвращает словарь путей
+    {копия: {формат: путь}}'''
+    data = read_image(source)
+    stripped = strip_metadata(data)
+    if stripped is not None:
+        replace_source(source, stripped)
+        data = stripped
+    image = open_image(data)
+    renditions = {'source': source}
+    for rendition, size in settings.IMAGE_RENDITIONS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        renditions[rendition] = {}
+        for extension in FORMATS:
+            path = rendition_path(recipe_id, source, rendition, extension)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            renditions[rendition][extension] = default_storage.save(
+                path, ContentFile(encode(resized, extension)))
+    return renditions
+
+
+def delete_renditions(renditions):
+    for rendition, paths in renditions.items():
+        if rendition == 'source':
+            continue
+        for path in paths.values():
+            default_storage.delete(path)
+
+
+def process_recipe_image(recipe_id, source):
+    from api.cache import invalidate
+    from .models import Recipe
+
+    try:
+        renditions = build_renditions(recipe_id, source)
+    except Exception:
+        logger.exception('Cannot process image %s of recipe %s',
+                         source, recipe_id)
+        return None
+    old = (Recipe.objects.filter(pk=recipe_id)
+           .values_list('renditions', flat=True).first())
+    # Картинку могли заменить, пока шла обработка: тогда
+    # результат устарел и не сохраняется
+    updated = Recipe.objects.filter(pk=recipe_id, image=source).update(
+        renditions=renditions)
+    if not updated:
+        delete_renditions(renditions)
+        return None
+    if old and old.get('source') != source:
+        delete_renditions(old)
+    invalidate('recipes')
+    return renditions
+
+
+def _run_in_worker(recipe_id, source):
+    close_old_connections()
+    try:
+        return process_recipe_image(recipe_id, source)
+    finally:
+        close_old_connections()
+
+
+def schedule_renditions(recipe):
+    '''Ставит обработку картинки в пул потоков после фиксации
+    транзакции; без пула обработка идёт синхронно'''
+    recipe_id, source = recipe.pk, recipe.image.name
+
+    def submit():
+        if settings.IMAGE_WORKERS:
+            get_executor().submit(_run_in_worker, recipe_id, source)
+        else:
+            process_recipe_image(recipe_id, source)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from recipe.images import process_recipe_image
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG renditions of recipe images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Rebuild renditions that are already up to date.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').values_list(
+            'pk', 'image', 'renditions')
+        processed = failed = 0
+        for recipe_id, source, renditions in recipes.iterator():
+            if not options['all'] and renditions.get('source') == source:
+                continue
+            if process_recipe_image(recipe_id, source) is None:
+                failed += 1
+                self.stderr.write(f'Recipe {recipe_id}: cannot process '
+                                  f'{source}')
+            else:
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Renditions built for {processed} recipes, {failed} failed.'))
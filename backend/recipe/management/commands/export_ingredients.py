@@ -0,0 +1,49 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+from recipe.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Stream the ingredient catalog to a CSV or JSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', help='Target file, standard output by default.')
+        parser.add_argument('--format', choices=('csv', 'json'),
+                            default='csv')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def rows(self, chunk_size):
+        return (Ingredient.objects
+                .order_by('name', 'measurement_unit')
+                .values_list('name', 'measurement_unit')
+                .iterator(chunk_size=chunk_size))
+
+    def write_csv(self, rows, output):
+        csv.writer(output).writerows(rows)
+
+    def write_json(self, rows, output):
+        # Тот же формат, что у recipe/data/ingredients.json
+        output.write('[')
+        for number, (name, unit) in enumerate(rows):
+            if number:
+                output.write(', ')
+            output.write(json.dumps(
+                {'name': name, 'measurement_unit': unit},
+                ensure_ascii=False))
+        output.write(']\n')
+
+    def handle(self, *args, **options):
+        writer = getattr(self, f'write_{options["format"]}')
+        rows = self.rows(options['chunk_size'])
+        if not options['output']:
+            writer(rows, sys.stdout)
+            return
+        with open(options['output'], 'w', encoding='utf-8',
+                  newline='') as output:
+            writer(rows, output)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ingredients exported to {options["output"]}'))
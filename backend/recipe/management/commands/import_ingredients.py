@@ -0,0 +1,113 @@
+import csv
+import json
+import os
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.cache import invalidate
+from recipe.models import CatalogVersion, Ingredient
+
+DEFAULT_PATH = 'recipe/data/ingredients.csv'
+READ_SIZE = 64 * 1024
+NAME_LENGTH = Ingredient._meta.get_field('name').max_length
+UNIT_LENGTH = Ingredient._meta.get_field('measurement_unit').max_length
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) == 2:
+            yield row
+        else:
+            yield None
+
+
+def read_json(file):
+    '''Читает JSON-массив объектов или JSON Lines по частям,
+    не загружая весь файл в память'''
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_SIZE).lstrip()
+    if buffer.startswith('['):
+        buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                if buffer:
+                    raise CommandError(f'Broken JSON near: {buffer[:80]}')
+                return
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        if isinstance(item, dict):
+            yield item.get('name'), item.get('measurement_unit')
+        else:
+            yield None
+
+
+def clean(rows):
+    for row in rows:
+        if row is None:
+            yield None
+            continue
+        name, unit = (str(value or '').strip() for value in row)
+        if (not name or not unit or len(name) > NAME_LENGTH
+                or len(unit) > UNIT_LENGTH):
+            yield None
+        else:
+            yield Ingredient(name=name, measurement_unit=unit)
+
+
+class Command(BaseCommand):
+    help = ('Load ingredients from a CSV (name,unit) or JSON file '
+            'in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='Input format, by default taken from the file extension.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = (options['format']
+                       or os.path.splitext(path)[1].lstrip('.').lower())
+        readers = {'csv': read_csv, 'json': read_json, 'jsonl': read_json}
+        if file_format not in readers:
+            raise CommandError(f'Unknown format of {path}, use --format.')
+        before = Ingredient.objects.count()
+        processed = skipped = 0
+        with open(path, encoding='utf-8', newline='') as file:
+            rows = clean(readers[file_format](file))
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                ingredients = [item for item in batch if item is not None]
+                skipped += len(batch) - len(ingredients)
+                processed += len(batch)
+                with transaction.atomic():
+                    # bulk_create минует Ingredient.save: версию
+                    # для синхронизации справочника ставим сами
+                    version = CatalogVersion.objects.next(
+                        Ingredient.catalog)
+                    for ingredient in ingredients:
+                        ingredient.version = version
+                    # Уже загруженные пары (name, measurement_unit)
+                    # отсекает ограничение unique_ingredient
+                    Ingredient.objects.bulk_create(
+                        ingredients, ignore_conflicts=True)
+                self.stdout.write(f'Processed {processed} rows...')
+        created = Ingredient.objects.count() - before
+        if created:
+            invalidate('ingredients', 'recipes')
+        self.stdout.write(self.style.SUCCESS(
+            f'{processed} rows read, {created} ingredients added, '
+            f'{skipped} rows skipped.'))
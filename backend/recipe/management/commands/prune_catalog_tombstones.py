@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from recipe.catalog import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = ('Delete catalog deletion records older than the retention '
+            'period. Clients that synced before it get a full snapshot.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.CATALOG_TOMBSTONE_DAYS,
+            help='Retention period in days.')
+
+    def handle(self, *args, **options):
+        pruned = prune_tombstones(options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {pruned} catalog deletion records.'))
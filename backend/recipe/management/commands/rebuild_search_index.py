@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Recalculate stored full-text search vectors of recipes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+        for start in range(0, len(recipe_ids), batch_size):
+            Recipe.objects.filter(
+                pk__in=recipe_ids[start:start + batch_size]
+            ).update_search_vector()
+        self.stdout.write(self.style.SUCCESS(
+            f'Search vectors updated for {len(recipe_ids)} recipes.'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipe.models import ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    help = 'Rebuild shopping cart ingredient totals and verify them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only compare stored totals with recalculated ones.')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            ShoppingCartIngredient.objects.rebuild()
+        expected = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in ShoppingCartIngredient.objects.expected()}
+        stored = dict(
+            ((user_id, ingredient_id), amount)
+            for user_id, ingredient_id, amount
+            in ShoppingCartIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'))
+        drift = sorted(
+            key for key in {*expected, *stored}
+            if expected.get(key) != stored.get(key))
+        for user_id, ingredient_id in drift:
+            self.stderr.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'stored={stored.get((user_id, ingredient_id))} '
+                f'expected={expected.get((user_id, ingredient_id))}')
+        if drift:
+            raise CommandError(f'Found {len(drift)} mismatched totals.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Shopping cart totals are consistent ({len(stored)} rows).'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipe.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = ('Compare favorite, recipe and subscriber counters with the '
+            'actual rows and repair drift.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report drift and exit with an error if any.')
+
+    def handle(self, *args, **options):
+        drift = reconcile_counters(fix=not options['check'])
+        state = 'out of sync' if options['check'] else 'repaired'
+        for counter, rows in drift.items():
+            self.stdout.write(f'{counter:<25} {rows} rows {state}')
+        if options['check'] and any(drift.values()):
+            raise CommandError('Counters are out of sync.')
+        self.stdout.write(self.style.SUCCESS('Counters are consistent.'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import invalidate
+from recipe.feeds import refresh_following, refresh_popular
+
+
+class Command(BaseCommand):
+    help = ('Incrementally refresh the popular recipes ranking and '
+            'the following feed. Run it periodically, with --full '
+            'from time to time to account for removed favorites.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Recalculate from scratch instead of since the last run.')
+        parser.add_argument('--only', choices=('popular', 'following'))
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['only'] in (None, 'popular'):
+            events = refresh_popular(options['full'], options['batch_size'])
+            self.stdout.write(f'Popular: {events} events processed.')
+        if options['only'] in (None, 'following'):
+            entries = refresh_following(
+                options['full'], options['batch_size'])
+            self.stdout.write(f'Following: {entries} feed entries written.')
+        invalidate('recipes')
+        self.stdout.write(self.style.SUCCESS('Feeds refreshed.'))
@@ -0,0 +1,186 @@
+import io
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from uuid import uuid4
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from api.cache import invalidate
+from recipe.counters import reconcile_counters
+from recipe.feeds import refresh_following, refresh_popular
+from recipe.models import (CatalogVersion, Favorite, Ingredient, Recipe,
+                           RecipeIngredients, ShoppingCartIngredient,
+                           ShoppingСart, Tag)
+from users.models import Subscribe, User
+
+SEED_IMAGE = 'recipe/seed.png'
+SEED_PASSWORD = 'seed-password'
+WORDS = (
+    'суп', 'салат', 'пирог', 'каша', 'рагу', 'запеканка', 'котлеты',
+    'блины', 'паста', 'омлет', 'плов', 'борщ', 'жаркое', 'соус', 'десерт',
+)
+ADJECTIVES = (
+    'домашний', 'быстрый', 'летний', 'острый', 'сладкий', 'овощной',
+    'сытный', 'праздничный', 'лёгкий', 'бабушкин',
+)
+
+
+@contextmanager
+def manual_pub_date():
+    '''Даёт задать pub_date вручную, чтобы лента была растянута
+    во времени, а не создана одной секундой'''
+    field = Recipe._meta.get_field('pub_date')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def unique_pairs(left, right, count, exclude_same=False):
+    capacity = len(left) * len(right) - (
+        min(len(left), len(right)) if exclude_same else 0)
+    count = min(count, capacity)
+    pairs = set()
+    while len(pairs) < count:
+        pair = (random.choice(left), random.choice(right))
+        if not (exclude_same and pair[0] == pair[1]):
+            pairs.add(pair)
+    return pairs
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic users, recipes and relations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--favorites', type=int, default=5000)
+        parser.add_argument('--carts', type=int, default=2000)
+        parser.add_argument('--subscriptions', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=365,
+                            help='Spread publication dates over N days.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def seed_image(self):
+        if not default_storage.exists(SEED_IMAGE):
+            buffer = io.BytesIO()
+            Image.new('RGB', (480, 320), '#d9a066').save(buffer, 'PNG')
+            default_storage.save(SEED_IMAGE, ContentFile(buffer.getvalue()))
+        return SEED_IMAGE
+
+    def create_users(self, count, run):
+        password = make_password(SEED_PASSWORD)
+        User.objects.bulk_create(
+            (User(username=f'seed_{run}_{i}',
+                  email=f'seed_{run}_{i}@example.com',
+                  first_name='Имя', last_name='Фамилия',
+                  password=password)
+             for i in range(count)),
+            batch_size=self.batch_size)
+        return list(User.objects.filter(
+            username__startswith=f'seed_{run}_').values_list('pk', flat=True))
+
+    def create_tags(self, count, run):
+        with transaction.atomic():
+            version = CatalogVersion.objects.next(Tag.catalog)
+            Tag.objects.bulk_create(
+                (Tag(name=f'Тег {run} {i}', slug=f'seed-{run}-{i}',
+                     color='#{:06x}'.format(color), version=version)
+                 for i, color in enumerate(
+                     random.sample(range(0x1000000), count))),
+                ignore_conflicts=True)
+        tags = list(Tag.objects.values_list('pk', flat=True))
+        if not tags:
+            raise CommandError('At least one tag is required.')
+        return tags
+
+    def create_recipes(self, count, authors, days, run):
+        image = self.seed_image()
+        now = timezone.now()
+        with manual_pub_date():
+            Recipe.objects.bulk_create(
+                (Recipe(
+                    author_id=random.choice(authors),
+                    name=(f'{random.choice(ADJECTIVES).capitalize()} '
+                          f'{random.choice(WORDS)} №{i}'),
+                    text=f'Описание рецепта {run} {i}. ' * 5,
+                    image=image,
+                    cooking_time=random.randint(5, 180),
+                    pub_date=now - timedelta(
+                        seconds=random.randint(0, days * 86400)))
+                 for i in range(count)),
+                batch_size=self.batch_size)
+        return list(Recipe.objects.filter(
+            text__startswith=f'Описание рецепта {run} ').values_list(
+                'pk', flat=True))
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.batch_size = options['batch_size']
+        run = uuid4().hex[:6]
+        ingredients = list(Ingredient.objects.values_list('pk', flat=True))
+        if not ingredients:
+            raise CommandError('Load ingredients first: '
+                               'python manage.py import_ingredients')
+        with transaction.atomic():
+            users = self.create_users(options['users'], run)
+            if not users:
+                raise CommandError('At least one user is required.')
+            tags = self.create_tags(options['tags'], run)
+            recipes = self.create_recipes(
+                options['recipes'], users, options['days'], run)
+
+            per_recipe = min(options['ingredients_per_recipe'],
+                             len(ingredients))
+            RecipeIngredients.objects.bulk_create(
+                (RecipeIngredients(recipe_id=recipe, ingredient_id=ingredient,
+                                   amount=random.randint(1, 500))
+                 for recipe in recipes
+                 for ingredient in random.sample(ingredients, per_recipe)),
+                batch_size=self.batch_size)
+            Recipe.tags.through.objects.bulk_create(
+                (Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+                 for recipe in recipes
+                 for tag in random.sample(tags, min(len(tags), 2))),
+                batch_size=self.batch_size)
+            Favorite.objects.bulk_create(
+                (Favorite(user_id=user, recipe_id=recipe)
+                 for user, recipe in unique_pairs(
+                     users, recipes, options['favorites'])),
+                batch_size=self.batch_size, ignore_conflicts=True)
+            ShoppingСart.objects.bulk_create(
+                (ShoppingСart(user_id=user, recipe_id=recipe)
+                 for user, recipe in unique_pairs(
+                     users, recipes, options['carts'])),
+                batch_size=self.batch_size, ignore_conflicts=True)
+            Subscribe.objects.bulk_create(
+                (Subscribe(user_id=user, author_id=author)
+                 for user, author in unique_pairs(
+                     users, users, options['subscriptions'],
+                     exclude_same=True)),
+                batch_size=self.batch_size, ignore_conflicts=True)
+
+            # bulk_create не вызывает сигналы: пересчитываем
+            # производные данные целиком
+            ShoppingCartIngredient.objects.rebuild()
+            reconcile_counters()
+            # Всё созданное видно в этой же транзакции: ждать
+            # фиксации чужих записей не нужно
+            refresh_popular(full=True, overlap=0)
+            refresh_following(full=True, overlap=0)
+            Recipe.objects.filter(pk__in=recipes).update_search_vector()
+        invalidate('tags', 'ingredients', 'recipes')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users, {len(recipes)} recipes '
+            f'(run {run}); password for seeded users: {SEED_PASSWORD}'))
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.18 on 2026-10-18 02:12
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_shopping_cart_ingredients(apps, schema_editor):
+    RecipeIngredients = apps.get_model('recipe', 'RecipeIngredients')
+    ShoppingCartIngredient = apps.get_model(
+        'recipe', 'ShoppingCartIngredient')
+    totals = (
+        RecipeIngredients.objects
+        .filter(recipe__shopping_cart_recipe__user__isnull=False)
+        .values('recipe__shopping_cart_recipe__user', 'ingredient')
+        .annotate(total=Sum('amount'))
+        .values_list('recipe__shopping_cart_recipe__user',
+                     'ingredient', 'total')
+        .order_by()
+    )
+    ShoppingCartIngredient.objects.bulk_create(
+        (ShoppingCartIngredient(user_id=user_id, ingredient_id=ingredient_id,
+                                amount=total)
+         for user_id, ingredient_id, total in totals),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipe', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.RenameModel(
+            old_name='ShoppingCart',
+            new_name='ShoppingСart',
+        ),
+        migrations.CreateModel(
+            name='ShoppingCartIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(default=0, verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_totals', to='recipe.ingredient', verbose_name='Ингридиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингридиент в списке покупок',
+                'verbose_name_plural': 'Ингридиенты в списке покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_cart_ingredient'),
+        ),
+        migrations.RunPython(fill_shopping_cart_ingredients,
+                             migrations.RunPython.noop),
+    ]
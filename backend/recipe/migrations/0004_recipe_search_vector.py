@@ -0,0 +1,55 @@
+# Generated by Django 3.2.18 on 2026-10-18 02:15
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+def create_search_indexes(apps, schema_editor):
+    # GIN-индексы и tsvector есть только в PostgreSQL,
+    # на SQLite поиск выполняется на Python
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX recipe_search_vector_idx '
+        'ON recipe_recipe USING gin (search_vector)')
+    schema_editor.execute(
+        'CREATE INDEX recipe_name_trgm_idx '
+        'ON recipe_recipe USING gin (name gin_trgm_ops)')
+    schema_editor.execute("""
+        UPDATE recipe_recipe AS recipe SET search_vector =
+            setweight(to_tsvector('russian',
+                coalesce(recipe.name, '')), 'A')
+            || setweight(to_tsvector('russian',
+                coalesce(recipe.text, '')), 'B')
+            || setweight(to_tsvector('russian', coalesce((
+                SELECT string_agg(ingredient.name, ' ')
+                FROM recipe_recipeingredients AS amount
+                JOIN recipe_ingredient AS ingredient
+                    ON ingredient.id = amount.ingredient_id
+                WHERE amount.recipe_id = recipe.id), '')), 'C')
+    """)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0003_shopping_cart_ingredient'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
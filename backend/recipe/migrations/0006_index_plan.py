@@ -0,0 +1,34 @@
+# Generated by Django 3.2.18 on 2026-10-18 02:17
+
+from django.db import migrations, models
+
+
+def create_ingredient_prefix_index(apps, schema_editor):
+    # Индекс под name__istartswith: Django сравнивает UPPER(name::text)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX ingredient_name_upper_idx ON recipe_ingredient '
+        '(UPPER(name::text) text_pattern_ops)')
+
+
+def drop_ingredient_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_upper_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0005_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.RunPython(create_ingredient_prefix_index,
+                             drop_ingredient_prefix_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.18 on 2026-10-18 02:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    return Coalesce(Subquery(
+        model.objects
+        .filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipe', 'Recipe')
+    Favorite = apps.get_model('recipe', 'Favorite')
+    User = apps.get_model('users', 'User')
+    Subscribe = apps.get_model('users', 'Subscribe')
+    Recipe.objects.update(favorites_count=count_of(Favorite, 'recipe'))
+    User.objects.update(recipes_count=count_of(Recipe, 'author'),
+                        subscribers_count=count_of(Subscribe, 'author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0007_recipe_renditions'),
+        ('users', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в избранное'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
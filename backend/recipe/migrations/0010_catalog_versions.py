@@ -0,0 +1,69 @@
+# Generated by Django 3.2.18 on 2026-10-18 02:38
+
+from django.db import migrations, models
+
+
+def create_counters(apps, schema_editor):
+    CatalogVersion = apps.get_model('recipe', 'CatalogVersion')
+    for name in ('ingredients', 'tags'):
+        CatalogVersion.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0009_feeds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('catalog', models.CharField(max_length=50)),
+                ('object_id', models.BigIntegerField()),
+                ('version', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Удалённая запись справочника',
+                'verbose_name_plural': 'Удалённые записи справочников',
+            },
+        ),
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Версия справочника',
+                'verbose_name_plural': 'Версии справочников',
+            },
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False, verbose_name='Версия'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False, verbose_name='Версия'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogtombstone',
+            index=models.Index(fields=['catalog', 'version'], name='catalog_tombstone_idx'),
+        ),
+        migrations.RunPython(create_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-18 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0010_catalog_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogversion',
+            name='pruned',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -1,12 +1,107 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core import validators
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Sum, Value, When
+
 from .validators import HexColorValidator
 
 User = get_user_model()
 
+# Истинно, пока рецепты удаляются через Recipe.delete()
+# или QuerySet.delete(): строки корзин и избранного уходят каскадом,
+# и их итоги пересчитываются одним пакетом на рецепт
+recipes_deleting = ContextVar('recipes_deleting', default=False)
+
+
+@contextmanager
+def deleting_recipes():
+    token = recipes_deleting.set(True)
+    try:
+        yield
+    finally:
+        recipes_deleting.reset(token)
 
-class Ingredient(models.Model):
+
+class CatalogVersionQuerySet(models.QuerySet):
+    def next(self, name):
+        '''Новая версия справочника. UPDATE блокирует строку счётчика
+        до конца транзакции, поэтому изменения фиксируются в порядке
+        версий и клиент с ?since= не пропустит ни одного'''
+        counter = self.filter(name=name)
+        if not counter.update(value=F('value') + 1):
+            self.get_or_create(name=name)
+            counter.update(value=F('value') + 1)
+        return counter.values_list('value', flat=True).get()
+
+
+class CatalogVersion(models.Model):
+    '''Последняя выданная версия справочника'''
+    name = models.CharField(
+        max_length=50,
+        primary_key=True,
+    )
+    value = models.BigIntegerField(default=0)
+    # Удалённые записи до этой версии уже забыты: клиенту
+    # с более старой версией нужен полный снимок
+    pruned = models.BigIntegerField(default=0)
+
+    objects = CatalogVersionQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+
+class CatalogTombstone(models.Model):
+    '''Удалённая запись справочника: нужна клиентам,
+    которые синхронизируются по ?since='''
+    catalog = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    version = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Удалённая запись справочника'
+        verbose_name_plural = 'Удалённые записи справочников'
+        indexes = [
+            models.Index(fields=['catalog', 'version'],
+                         name='catalog_tombstone_idx')]
+
+
+class CatalogItem(models.Model):
+    '''Запись справочника с версией изменения.
+    bulk_create и update() версию не выставляют — это делает
+    вызывающий код через CatalogVersion.objects.next'''
+    catalog = None
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+    )
+    version = models.BigIntegerField(
+        default=0,
+        db_index=True,
+        editable=False,
+        verbose_name='Версия',
+    )
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self.version = CatalogVersion.objects.next(self.catalog)
+            super().save(*args, **kwargs)
+
+
+class Ingredient(CatalogItem):
+    catalog = 'ingredients'
     name = models.CharField(
         max_length=200,
         blank=False,
@@ -29,7 +124,8 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Tag(models.Model):
+class Tag(CatalogItem):
+    catalog = 'tags'
     name = models.CharField(max_length=200, unique=True)
     color = models.TextField(
         unique=True,
@@ -45,6 +141,47 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        '''Подгрузка автора, тегов и ингредиентов фиксированным
+        числом запросов, независимо от количества рецептов'''
+        return self.select_related('author').prefetch_related(
+            'tags', 'recipe_ingredient__ingredient')
+
+    def update_search_vector(self):
+        '''Пересчёт сохранённого tsvector по названию, описанию
+        и ингредиентам рецептов (только PostgreSQL)'''
+        if connection.vendor != 'postgresql':
+            return
+        recipe_ids = list(self.values_list('pk', flat=True))
+        if not recipe_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {Recipe._meta.db_table} AS recipe SET search_vector =
+                    setweight(to_tsvector(%(config)s,
+                        coalesce(recipe.name, '')), 'A')
+                    || setweight(to_tsvector(%(config)s,
+                        coalesce(recipe.text, '')), 'B')
+                    || setweight(to_tsvector(%(config)s, coalesce((
+                        SELECT string_agg(ingredient.name, ' ')
+                        FROM {RecipeIngredients._meta.db_table} AS amount
+                        JOIN {Ingredient._meta.db_table} AS ingredient
+                            ON ingredient.id = amount.ingredient_id
+                        WHERE amount.recipe_id = recipe.id), '')), 'C')
+                WHERE recipe.id = ANY(%(ids)s)
+                """,
+                {'config': 'russian', 'ids': recipe_ids})
+
+    def delete(self):
+        with deleting_recipes():
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -94,15 +231,50 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         auto_now_add=True,
         verbose_name='Дата публикации')
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлено в избранное',
+    )
+    renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии картинки',
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['-favorites_count', '-pub_date'],
+                         name='recipe_favorites_count_idx')]
 
     def __str__(self):
         return f'Рецепт: "{self.name}"'
 
+    def delete(self, *args, **kwargs):
+        with deleting_recipes():
+            return super().delete(*args, **kwargs)
+
+    def image_url(self, rendition, extension):
+        '''Адрес уменьшенной копии; пока копии не готовы — оригинал'''
+        path = self.renditions.get(rendition, {}).get(extension)
+        if path:
+            return self.image.storage.url(path)
+        return self.image.url
+
 
 class RecipeIngredients(models.Model):
     recipe = models.ForeignKey(
@@ -150,6 +322,11 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Рецепт в избранном',
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата добавления',
+    )
 
     class Meta:
         verbose_name = 'Избранный рецепт'
@@ -177,6 +354,11 @@ class ShoppingСart(models.Model):
         related_name='shopping_cart_recipe',
         verbose_name='Рецепт в корзине',
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата добавления',
+    )
 
     class Meta:
         verbose_name = 'Корзина покупок'
@@ -189,3 +371,207 @@ class ShoppingСart(models.Model):
 
     def __str__(self):
         return f'{self.user}, {self.recipe}'
+
+
+class ShoppingCartIngredientQuerySet(models.QuerySet):
+    def apply_deltas(self, deltas):
+        '''Атомарно прибавляет изменения количества
+        {(user_id, ingredient_id): delta} к итогам корзин'''
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        user_ids = {user_id for user_id, _ in deltas}
+        ingredient_ids = {ingredient_id for _, ingredient_id in deltas}
+        with transaction.atomic():
+            self.bulk_create(
+                [self.model(user_id=user_id, ingredient_id=ingredient_id,
+                            amount=0)
+                 for user_id, ingredient_id in deltas],
+                ignore_conflicts=True)
+            rows = self.filter(user_id__in=user_ids,
+                               ingredient_id__in=ingredient_ids)
+            rows.update(amount=F('amount') + Case(
+                *[When(user_id=user_id, ingredient_id=ingredient_id,
+                       then=Value(delta))
+                  for (user_id, ingredient_id), delta in deltas.items()],
+                default=Value(0),
+                output_field=models.IntegerField()))
+            rows.filter(amount__lte=0).delete()
+
+    def _recipes_deltas(self, user_id, recipe_ids, sign):
+        deltas = {}
+        for ingredient_id, amount in (
+                RecipeIngredients.objects
+                .filter(recipe_id__in=recipe_ids)
+                .values_list('ingredient_id', 'amount')):
+            key = (user_id, ingredient_id)
+            deltas[key] = deltas.get(key, 0) + sign * amount
+        return deltas
+
+    def add_recipes(self, user_id, recipe_ids):
+        '''Рецепты добавлены в корзину пользователя'''
+        self.apply_deltas(self._recipes_deltas(user_id, recipe_ids, 1))
+
+    def remove_recipes(self, user_id, recipe_ids):
+        '''Рецепты удалены из корзины пользователя'''
+        self.apply_deltas(self._recipes_deltas(user_id, recipe_ids, -1))
+
+    def recipe_changed(self, recipe, old_amounts, new_amounts):
+        '''Ингредиенты рецепта изменились: пересчёт итогов
+        во всех корзинах, где он лежит'''
+        changes = {
+            ingredient_id: (new_amounts.get(ingredient_id, 0)
+                            - old_amounts.get(ingredient_id, 0))
+            for ingredient_id in {*old_amounts, *new_amounts}}
+        changes = {key: delta for key, delta in changes.items() if delta}
+        if not changes:
+            return
+        user_ids = ShoppingСart.objects.filter(
+            recipe=recipe).values_list('user_id', flat=True)
+        self.apply_deltas({
+            (user_id, ingredient_id): delta
+            for user_id in user_ids
+            for ingredient_id, delta in changes.items()})
+
+    def recipe_deleted(self, recipe):
+        '''Рецепт удаляется: его ингредиенты вычитаются
+        из всех корзин, где он лежит, одним пакетом'''
+        self.recipe_changed(recipe, dict(
+            recipe.recipe_ingredient.values_list('ingredient_id', 'amount')
+        ), {})
+
+    def expected(self):
+        '''Итоги корзин, посчитанные заново по рецептам'''
+        return (
+            RecipeIngredients.objects
+            .filter(recipe__shopping_cart_recipe__user__isnull=False)
+            .values('recipe__shopping_cart_recipe__user', 'ingredient')
+            .annotate(total=Sum('amount'))
+            .values_list('recipe__shopping_cart_recipe__user',
+                         'ingredient', 'total')
+            .order_by()
+        )
+
+    def rebuild(self):
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(
+                (self.model(user_id=user_id, ingredient_id=ingredient_id,
+                            amount=total)
+                 for user_id, ingredient_id, total in self.expected()),
+                batch_size=1000)
+
+
+class ShoppingCartIngredient(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_cart_ingredients',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингридиент',
+        related_name='shopping_cart_totals',
+    )
+    amount = models.IntegerField(
+        default=0,
+        verbose_name='Количество',
+    )
+
+    objects = ShoppingCartIngredientQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ингридиент в списке покупок'
+        verbose_name_plural = 'Ингридиенты в списке покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_ingredient')]
+
+    def __str__(self):
+        return f'{self.user}, {self.ingredient} {self.amount}'
+
+
+class PopularRecipe(models.Model):
+    '''Рейтинг рецепта по избранному и корзинам с затуханием
+    во времени; пересчитывается командой refresh_feeds'''
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='popularity',
+        verbose_name='Рецепт',
+    )
+    score = models.FloatField(
+        verbose_name='Рейтинг',
+    )
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинг рецептов'
+        indexes = [
+            models.Index(fields=['-score', '-recipe'],
+                         name='popular_recipe_score_idx')]
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.score:.3f}'
+
+
+class FeedEntry(models.Model):
+    '''Рецепт автора в ленте подписчика; заполняется
+    командой refresh_feeds'''
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Лента подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry')]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='feed_entry_user_pub_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='feed_entry_user_author_idx')]
+
+    def __str__(self):
+        return f'{self.user}, {self.recipe_id}'
+
+
+class FeedWatermark(models.Model):
+    '''До какого момента события учтены в ленте'''
+    name = models.CharField(
+        max_length=50,
+        primary_key=True,
+    )
+    value = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Отметка пересчёта ленты'
+        verbose_name_plural = 'Отметки пересчёта ленты'
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
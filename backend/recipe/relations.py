@@ -0,0 +1,103 @@
+import time
+from array import array
+
+from django.conf import settings
+from django.core.cache import caches
+
+from users.models import Subscribe
+from .models import Favorite, ShoppingСart
+
+VERSION_KEY = 'relations:{}:version'
+IDS_KEY = 'relations:{}:{}:{}'
+# Набор: (модель связи, поле с идентификатором цели)
+KINDS = {
+    'favorites': (Favorite, 'recipe_id'),
+    'cart': (ShoppingСart, 'recipe_id'),
+    'following': (Subscribe, 'author_id'),
+}
+
+
+def shared_cache():
+    alias = settings.RELATIONS_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def user_version(cache, user_id):
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Время, а не 1: после вытеснения ключа версия
+        # не должна совпасть с одной из прежних
+        version = int(time.time() * 1000)
+        cache.add(key, version, None)
+    return version
+
+
+def relations_changed(user_id):
+    '''Избранное, корзина или подписки пользователя изменились:
+    закэшированные наборы прежней версии больше не читаются'''
+    cache = shared_cache()
+    if cache is None:
+        return
+    key = VERSION_KEY.format(user_id)
+    current = cache.get(key) or 0
+    cache.set(key, max(int(time.time() * 1000), current + 1), None)
+
+
+class UserRelations:
+    '''Избранное, корзина и подписки одного пользователя.
+    Каждый набор читается из БД (или общего кэша) не больше
+    одного раза и только если он понадобился'''
+
+    def __init__(self, user):
+        self.user_id = user.pk if user.is_authenticated else None
+        self.sets = {}
+
+    def ids(self, kind):
+        if kind not in self.sets:
+            self.sets[kind] = self.load(kind)
+        return self.sets[kind]
+
+    def load(self, kind):
+        if self.user_id is None:
+            return frozenset()
+        cache = shared_cache()
+        if cache is None:
+            return frozenset(self.query(kind))
+        key = IDS_KEY.format(
+            self.user_id, user_version(cache, self.user_id), kind)
+        packed = cache.get(key)
+        if packed is None:
+            # Отсортированный массив 8-байтовых чисел вместо
+            # pickle множества: в разы меньше в кэше
+            ids = array('q', sorted(self.query(kind)))
+            cache.set(key, ids.tobytes(),
+                      settings.RELATIONS_CACHE_TIMEOUT)
+        else:
+            ids = array('q')
+            ids.frombytes(packed)
+        return frozenset(ids)
+
+    def query(self, kind):
+        model, field = KINDS[kind]
+        return (model.objects.filter(user_id=self.user_id)
+                .order_by().values_list(field, flat=True))
+
+    def is_favorited(self, recipe_id):
+        return recipe_id in self.ids('favorites')
+
+    def is_in_shopping_cart(self, recipe_id):
+        return recipe_id in self.ids('cart')
+
+    def is_subscribed(self, author_id):
+        return author_id in self.ids('following')
+
+
+def user_relations(request):
+    '''Связи текущего пользователя, общие для всех
+    сериализаторов одного запроса'''
+    relations = getattr(request, '_user_relations', None)
+    if relations is None:
+        relations = UserRelations(request.user)
+        request._user_relations = relations
+    return relations
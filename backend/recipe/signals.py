@@ -0,0 +1,87 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from users.models import Subscribe, User
+from .catalog import record_deletion
+from .counters import change_counter
+from .images import delete_renditions, schedule_renditions
+from .models import (Favorite, FeedEntry, Ingredient, Recipe,
+                     ShoppingCartIngredient, ShoppingСart, Tag,
+                     recipes_deleting)
+from .relations import relations_changed
+
+
+@receiver(post_save, sender=ShoppingСart)
+def shopping_cart_recipe_added(sender, instance, created, **kwargs):
+    if created:
+        ShoppingCartIngredient.objects.add_recipes(
+            instance.user_id, [instance.recipe_id])
+
+
+@receiver(pre_delete, sender=ShoppingСart)
+def shopping_cart_recipe_removed(sender, instance, **kwargs):
+    # pre_delete: при каскадном удалении (например, пользователя)
+    # ингредиенты рецепта ещё на месте, и вычесть их можно корректно.
+    # Корзины удаляемого рецепта пересчитывает recipe_deleting
+    if recipes_deleting.get():
+        return
+    ShoppingCartIngredient.objects.remove_recipes(
+        instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_added(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, 'favorites_count', instance.recipe_id, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_removed(sender, instance, **kwargs):
+    if not recipes_deleting.get():
+        change_counter(Recipe, 'favorites_count', instance.recipe_id, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, 'recipes_count', instance.author_id, 1)
+    if instance.image and (
+            instance.renditions.get('source') != instance.image.name):
+        schedule_renditions(instance)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    # Каскад удаляет строки корзин после всех pre_delete, так что
+    # держатели рецепта и его ингредиенты здесь ещё видны
+    if recipes_deleting.get():
+        ShoppingCartIngredient.objects.recipe_deleted(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    change_counter(User, 'recipes_count', instance.author_id, -1)
+    delete_renditions(instance.renditions)
+
+
+@receiver(post_delete, sender=Subscribe)
+def subscribe_removed(sender, instance, **kwargs):
+    FeedEntry.objects.filter(
+        user_id=instance.user_id, author_id=instance.author_id).delete()
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingСart)
+@receiver(post_delete, sender=ShoppingСart)
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def user_relation_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: relations_changed(instance.user_id))
+
+
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+def catalog_item_deleted(sender, instance, **kwargs):
+    record_deletion(instance.catalog, instance.pk)
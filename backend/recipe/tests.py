@@ -0,0 +1,353 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from users.models import Subscribe, User
+from .catalog import catalog_delta, catalog_version, prune_tombstones
+from .counters import reconcile_counters
+from .feeds import refresh_following, refresh_popular
+from .models import (CatalogTombstone, Favorite, FeedEntry, Ingredient,
+                     PopularRecipe, Recipe, RecipeIngredients,
+                     ShoppingCartIngredient, ShoppingСart, Tag)
+from .toggles import add_relations, remove_relations
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.author, self.reader = (
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com',
+                password='Passw0rd!x', first_name='Имя',
+                last_name='Фамилия')
+            for name in ('author', 'reader'))
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            image='recipe/test.png', cooking_time=5)
+
+    def counters(self):
+        self.author.refresh_from_db()
+        self.recipe.refresh_from_db()
+        return (self.recipe.favorites_count, self.author.recipes_count,
+                self.author.subscribers_count)
+
+    def test_signals(self):
+        self.assertEqual(self.counters(), (0, 1, 0))
+        favorite = Favorite.objects.create(
+            user=self.reader, recipe=self.recipe)
+        subscription = Subscribe.objects.create(
+            user=self.reader, author=self.author)
+        self.assertEqual(self.counters(), (1, 1, 1))
+        favorite.delete()
+        subscription.delete()
+        self.assertEqual(self.counters(), (0, 1, 0))
+
+    def test_bulk_toggles(self):
+        add_relations(Favorite, self.reader.pk, [self.recipe.pk])
+        # Повтор не увеличивает счётчик второй раз
+        add_relations(Favorite, self.reader.pk, [self.recipe.pk])
+        add_relations(Subscribe, self.reader.pk, [self.author.pk])
+        self.assertEqual(self.counters(), (1, 1, 1))
+        remove_relations(Favorite, self.reader.pk, [self.recipe.pk])
+        remove_relations(Subscribe, self.reader.pk, [self.author.pk])
+        self.assertEqual(self.counters(), (0, 1, 0))
+
+    def test_recipe_deleted(self):
+        self.recipe.delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_reconcile(self):
+        Favorite.objects.create(user=self.reader, recipe=self.recipe)
+        Recipe.objects.filter(pk=self.recipe.pk).update(favorites_count=7)
+        User.objects.filter(pk=self.author.pk).update(recipes_count=0)
+        with self.assertRaises(CommandError):
+            call_command('reconcile_counters', check=True,
+                         stdout=StringIO())
+        self.assertEqual(self.counters(), (7, 0, 0))
+        drift = reconcile_counters()
+        self.assertEqual(drift['recipe.favorites_count'], 1)
+        self.assertEqual(drift['user.recipes_count'], 1)
+        self.assertEqual(self.counters(), (1, 1, 0))
+        self.assertFalse(any(reconcile_counters(fix=False).values()))
+
+
+@override_settings(FEED_WATERMARK_OVERLAP=60)
+class FeedWatermarkTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.author, self.reader = (
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com',
+                password='Passw0rd!x', first_name='Имя',
+                last_name='Фамилия')
+            for name in ('author', 'reader'))
+        self.recipes = [
+            Recipe.objects.create(
+                author=self.author, name=f'Рецепт {i}', text='Описание',
+                image='recipe/test.png', cooking_time=5)
+            for i in range(2)]
+
+    def at(self, seconds):
+        return mock.patch('recipe.feeds.timezone.now',
+                          return_value=self.now + timedelta(seconds=seconds))
+
+    def favorite(self, recipe, seconds):
+        favorite = Favorite.objects.create(user=self.reader, recipe=recipe)
+        Favorite.objects.filter(pk=favorite.pk).update(
+            created=self.now + timedelta(seconds=seconds))
+
+    def scores(self):
+        return dict(PopularRecipe.objects.values_list('recipe', 'score'))
+
+    def test_late_commit_is_counted(self):
+        with self.at(0):
+            refresh_popular(full=True)
+        # Транзакция поставила отметку до запуска, а зафиксировалась
+        # после него
+        self.favorite(self.recipes[0], -30)
+        with self.at(120):
+            refresh_popular()
+        self.assertIn(self.recipes[0].pk, self.scores())
+
+    def test_events_counted_once(self):
+        self.favorite(self.recipes[0], -300)
+        self.favorite(self.recipes[1], -30)
+        with self.at(0):
+            refresh_popular(full=True)
+        self.assertNotIn(self.recipes[1].pk, self.scores())
+        with self.at(120):
+            refresh_popular()
+        incremental = self.scores()
+        with self.at(240):
+            refresh_popular()
+        self.assertEqual(self.scores(), incremental)
+        with self.at(240):
+            refresh_popular(full=True)
+        for recipe_id, score in self.scores().items():
+            self.assertAlmostEqual(incremental[recipe_id], score)
+
+    def test_late_subscription_reaches_feed(self):
+        with self.at(0):
+            refresh_following(full=True)
+        subscription = Subscribe.objects.create(
+            user=self.reader, author=self.author)
+        Subscribe.objects.filter(pk=subscription.pk).update(
+            created=self.now - timedelta(seconds=30))
+        with self.at(120):
+            refresh_following()
+        self.assertEqual(
+            FeedEntry.objects.filter(user=self.reader).count(), 2)
+
+
+class CatalogTests(TestCase):
+    def setUp(self):
+        self.salt = Ingredient.objects.create(
+            name='соль', measurement_unit='г')
+        self.sugar = Ingredient.objects.create(
+            name='сахар', measurement_unit='г')
+
+    def test_version_is_read_from_database(self):
+        version = catalog_version('ingredients')
+        Ingredient.objects.filter(pk=self.salt.pk).update(name='соль морская')
+        self.salt.refresh_from_db()
+        self.salt.save()
+        self.assertEqual(catalog_version('ingredients'), version + 1)
+        with self.assertNumQueries(1):
+            catalog_version('ingredients')
+
+    def test_delta_returns_changes_and_deletions(self):
+        since = catalog_version('ingredients')
+        sugar_id = self.sugar.pk
+        self.sugar.delete()
+        pepper = Ingredient.objects.create(name='перец', measurement_unit='г')
+        delta = catalog_delta('ingredients', since)
+        self.assertFalse(delta['full'])
+        self.assertEqual(delta['changed']['id'], [pepper.pk])
+        self.assertEqual(delta['deleted'], [sugar_id])
+
+    def test_pruned_tombstones_force_full_snapshot(self):
+        since = catalog_version('ingredients')
+        self.sugar.delete()
+        CatalogTombstone.objects.update(
+            deleted_at=timezone.now() - timedelta(days=100))
+        self.assertEqual(prune_tombstones(days=90), 1)
+        self.assertFalse(CatalogTombstone.objects.exists())
+        delta = catalog_delta('ingredients', since)
+        self.assertTrue(delta['full'])
+        self.assertEqual(delta['changed']['id'], [self.salt.pk])
+        self.assertEqual(delta['deleted'], [])
+
+    def test_recent_tombstones_are_kept(self):
+        tag = Tag.objects.create(name='завтрак', color='#E26C2D', slug='b')
+        since = catalog_version('tags')
+        tag_id = tag.pk
+        tag.delete()
+        self.assertEqual(prune_tombstones(days=90), 0)
+        self.assertEqual(catalog_delta('tags', since)['deleted'], [tag_id])
+
+
+class ShoppingCartTotalsTests(APITestCase):
+    '''Итоги корзин после каждого изменения совпадают
+    с rebuild_shopping_cart --check'''
+
+    def setUp(self):
+        self.author, self.reader, self.other = (
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com',
+                password='Passw0rd!x', first_name='Имя',
+                last_name='Фамилия')
+            for name in ('author', 'reader', 'other'))
+        self.tag = Tag.objects.create(
+            name='обед', color='#E26C2D', slug='lunch')
+        self.flour, self.milk, self.eggs = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'молоко', 'яйца'))
+        self.pancakes = self.recipe(
+            'Блины', {self.flour: 200, self.milk: 500})
+        self.pie = self.recipe('Пирог', {self.flour: 300, self.eggs: 2})
+
+    def recipe(self, name, amounts):
+        recipe = Recipe.objects.create(
+            author=self.author, name=name, text='Описание',
+            image='recipe/test.png', cooking_time=5)
+        recipe.tags.set([self.tag])
+        for ingredient, amount in amounts.items():
+            RecipeIngredients.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=amount)
+        return recipe
+
+    def totals(self, user):
+        return dict(ShoppingCartIngredient.objects.filter(user=user)
+                    .values_list('ingredient__name', 'amount'))
+
+    def assertConsistent(self):
+        # Без расхождений команда завершается без CommandError
+        call_command('rebuild_shopping_cart', check=True,
+                     stdout=StringIO(), stderr=StringIO())
+
+    def test_add_and_remove(self):
+        self.client.force_authenticate(self.reader)
+        for recipe in (self.pancakes, self.pie):
+            response = self.client.post(
+                f'/api/recipes/{recipe.pk}/shopping_cart/')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.totals(self.reader),
+                         {'мука': 500, 'молоко': 500, 'яйца': 2})
+        self.assertConsistent()
+        response = self.client.delete(
+            f'/api/recipes/{self.pancakes.pk}/shopping_cart/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.totals(self.reader), {'мука': 300, 'яйца': 2})
+        self.assertConsistent()
+        # Строки, удалённые через ORM, обрабатывают сигналы
+        ShoppingСart.objects.create(user=self.reader, recipe=self.pancakes)
+        ShoppingСart.objects.filter(user=self.reader, recipe=self.pie).delete()
+        self.assertEqual(self.totals(self.reader),
+                         {'мука': 200, 'молоко': 500})
+        self.assertConsistent()
+
+    def test_patch_changes_ingredients(self):
+        ShoppingСart.objects.create(user=self.reader, recipe=self.pancakes)
+        ShoppingСart.objects.create(user=self.other, recipe=self.pancakes)
+        ShoppingСart.objects.create(user=self.other, recipe=self.pie)
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            f'/api/recipes/{self.pancakes.pk}/',
+            {'name': 'Блины', 'text': 'Описание', 'cooking_time': 5,
+             'tags': [self.tag.pk],
+             'ingredients': [{'id': self.flour.pk, 'amount': 250},
+                             {'id': self.eggs.pk, 'amount': 3}]},
+            format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.totals(self.reader), {'мука': 250, 'яйца': 3})
+        self.assertEqual(self.totals(self.other), {'мука': 550, 'яйца': 5})
+        self.assertConsistent()
+
+    def test_recipe_deleted(self):
+        for user in (self.reader, self.other):
+            ShoppingСart.objects.create(user=user, recipe=self.pancakes)
+            ShoppingСart.objects.create(user=user, recipe=self.pie)
+            Favorite.objects.create(user=user, recipe=self.pie)
+        self.client.force_authenticate(self.author)
+        response = self.client.delete(f'/api/recipes/{self.pie.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.totals(self.reader),
+                         {'мука': 200, 'молоко': 500})
+        self.assertConsistent()
+        Recipe.objects.filter(pk=self.pancakes.pk).delete()
+        self.assertFalse(ShoppingCartIngredient.objects.exists())
+        self.assertConsistent()
+
+    def test_recipe_delete_queries_do_not_grow(self):
+        def queries(recipe, holders):
+            for user in holders:
+                ShoppingСart.objects.create(user=user, recipe=recipe)
+                Favorite.objects.create(user=user, recipe=recipe)
+            with CaptureQueriesContext(connection) as context:
+                recipe.delete()
+            return len(context.captured_queries)
+        self.assertEqual(queries(self.pancakes, [self.reader]),
+                         queries(self.pie, [self.reader, self.other,
+                                            self.author]))
+        self.assertConsistent()
+
+    def test_user_deleted(self):
+        ShoppingСart.objects.create(user=self.reader, recipe=self.pancakes)
+        ShoppingСart.objects.create(user=self.other, recipe=self.pie)
+        self.reader.delete()
+        self.assertFalse(self.totals(self.reader))
+        self.assertConsistent()
+        # Каскад удаляет рецепты автора вместе с чужими корзинами
+        self.author.delete()
+        self.assertFalse(ShoppingCartIngredient.objects.exists())
+        self.assertConsistent()
+
+    def test_ingredient_deleted(self):
+        ShoppingСart.objects.create(user=self.reader, recipe=self.pancakes)
+        ShoppingСart.objects.create(user=self.reader, recipe=self.pie)
+        self.flour.delete()
+        self.assertEqual(self.totals(self.reader),
+                         {'молоко': 500, 'яйца': 2})
+        self.assertConsistent()
+
+    def test_admin_save_related(self):
+        ShoppingСart.objects.create(user=self.reader, recipe=self.pancakes)
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com',
+            password='Passw0rd!x')
+        self.client.force_login(admin)
+        rows = dict(self.pancakes.recipe_ingredient.values_list(
+            'ingredient', 'pk'))
+        response = self.client.post(
+            f'/admin/recipe/recipe/{self.pancakes.pk}/change/', {
+                'author': self.author.pk, 'name': 'Блины',
+                'text': 'Описание', 'tags': [self.tag.pk],
+                'cooking_time': 5,
+                'recipe_ingredient-TOTAL_FORMS': 3,
+                'recipe_ingredient-INITIAL_FORMS': 2,
+                'recipe_ingredient-MIN_NUM_FORMS': 0,
+                'recipe_ingredient-MAX_NUM_FORMS': 1000,
+                'recipe_ingredient-0-id': rows[self.milk.pk],
+                'recipe_ingredient-0-recipe': self.pancakes.pk,
+                'recipe_ingredient-0-ingredient': self.milk.pk,
+                'recipe_ingredient-0-amount': 500,
+                'recipe_ingredient-0-DELETE': 'on',
+                'recipe_ingredient-1-id': rows[self.flour.pk],
+                'recipe_ingredient-1-recipe': self.pancakes.pk,
+                'recipe_ingredient-1-ingredient': self.flour.pk,
+                'recipe_ingredient-1-amount': 150,
+                'recipe_ingredient-2-recipe': self.pancakes.pk,
+                'recipe_ingredient-2-ingredient': self.eggs.pk,
+                'recipe_ingredient-2-amount': 4,
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.totals(self.reader), {'мука': 150, 'яйца': 4})
+        self.assertConsistent()
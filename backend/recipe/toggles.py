@@ -0,0 +1,143 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from users.models import Subscribe, User
+from .counters import change_counters
+from .models import (Favorite, FeedEntry, Recipe, ShoppingCartIngredient,
+                     ShoppingСart)
+from .relations import relations_changed
+
+
+def _favorites_changed(user_id, recipe_ids, delta):
+    change_counters(Recipe, 'favorites_count', recipe_ids, delta)
+
+
+def _cart_changed(user_id, recipe_ids, delta):
+    if delta > 0:
+        ShoppingCartIngredient.objects.add_recipes(user_id, recipe_ids)
+    else:
+        ShoppingCartIngredient.objects.remove_recipes(user_id, recipe_ids)
+
+
+def _subscriptions_changed(user_id, author_ids, delta):
+    change_counters(User, 'subscribers_count', author_ids, delta)
+    if delta < 0:
+        FeedEntry.objects.filter(
+            user_id=user_id, author_id__in=author_ids).delete()
+
+
+# Связь: (поле цели, обработчик изменений). Запросы ниже минуют
+# сигналы post_save/post_delete, поэтому то, что делают сигналы,
+# здесь вызывается явно
+RELATIONS = {
+    Favorite: ('recipe', _favorites_changed),
+    ShoppingСart: ('recipe', _cart_changed),
+    Subscribe: ('author', _subscriptions_changed),
+}
+
+
+def supports_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    return (connection.vendor == 'sqlite'
+            and connection.Database.sqlite_version_info >= (3, 35))
+
+
+def _columns(model, field):
+    quote = connection.ops.quote_name
+    target = model._meta.get_field(field)
+    target_model = target.related_model
+    return {
+        'table': quote(model._meta.db_table),
+        'user': quote(model._meta.get_field('user').column),
+        'target': quote(target.column),
+        'target_table': quote(target_model._meta.db_table),
+        'target_pk': quote(target_model._meta.pk.column),
+    }
+
+
+def _insert(model, field, user_id, target_ids):
+    '''INSERT ... ON CONFLICT DO NOTHING RETURNING: возвращает
+    только действительно добавленные связи. Несуществующие цели
+    отбрасывает SELECT, а не внешний ключ'''
+    sql = (
+        'INSERT INTO {table} ({user}, {target}, created) '
+        'SELECT %s, {target_pk}, %s FROM {target_table} '
+        'WHERE {target_pk} IN ({placeholders}) '
+        'ON CONFLICT ({user}, {target}) DO NOTHING '
+        'RETURNING {target}').format(
+            placeholders=', '.join(['%s'] * len(target_ids)),
+            **_columns(model, field))
+    created = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, created, *target_ids])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _delete(model, field, user_id, target_ids):
+    sql = ('DELETE FROM {table} WHERE {user} = %s '
+           'AND {target} IN ({placeholders}) RETURNING {target}').format(
+               placeholders=', '.join(['%s'] * len(target_ids)),
+               **_columns(model, field))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, *target_ids])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _insert_fallback(model, field, user_id, target_ids):
+    # Без RETURNING (старый SQLite) две гонки за одну связь
+    # могут обе посчитать её своей: режим только для разработки
+    target_model = model._meta.get_field(field).related_model
+    existing = set(model.objects.filter(
+        user_id=user_id, **{f'{field}_id__in': target_ids}
+    ).values_list(f'{field}_id', flat=True))
+    added = [pk for pk in target_model.objects.filter(
+        pk__in=target_ids).values_list('pk', flat=True)
+        if pk not in existing]
+    model.objects.bulk_create(
+        [model(user_id=user_id, **{f'{field}_id': pk}) for pk in added],
+        ignore_conflicts=True)
+    return added
+
+
+def _delete_fallback(model, field, user_id, target_ids):
+    rows = model.objects.filter(
+        user_id=user_id, **{f'{field}_id__in': target_ids})
+    removed = list(rows.values_list(f'{field}_id', flat=True))
+    # _raw_delete: без сигналов, как и DELETE ... RETURNING
+    rows._raw_delete(rows.db)
+    return removed
+
+
+def add_relations(model, user_id, target_ids):
+    '''Добавляет связи пользователя с рецептами (или авторами)
+    одним запросом. Повтор и гонка двух одинаковых запросов
+    безопасны: уже существующие связи пропускаются. Возвращает
+    идентификаторы добавленных'''
+    field, changed = RELATIONS[model]
+    target_ids = list(dict.fromkeys(target_ids))
+    if not target_ids:
+        return []
+    insert = _insert if supports_returning() else _insert_fallback
+    with transaction.atomic():
+        added = insert(model, field, user_id, target_ids)
+        if added:
+            changed(user_id, added, 1)
+            transaction.on_commit(lambda: relations_changed(user_id))
+    return added
+
+
+def remove_relations(model, user_id, target_ids):
+    '''Удаляет связи одним запросом и возвращает
+    идентификаторы действительно удалённых'''
+    field, changed = RELATIONS[model]
+    target_ids = list(dict.fromkeys(target_ids))
+    if not target_ids:
+        return []
+    delete = _delete if supports_returning() else _delete_fallback
+    with transaction.atomic():
+        removed = delete(model, field, user_id, target_ids)
+        if removed:
+            changed(user_id, removed, -1)
+            transaction.on_commit(lambda: relations_changed(user_id))
+    return removed
@@ -7,6 +7,7 @@ from .models import User, Subscribe
 class UserAdmin(admin.ModelAdmin):
     list_display = (
         'pk', 'username', 'email', 'first_name', 'last_name',
+        'recipes_count', 'subscribers_count',
     )
     list_filter = ('username', 'email',)
     search_fields = ('username', 'email')
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.18 on 2026-10-18 02:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscribe',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата подписки'),
+            preserve_default=False,
+        ),
+    ]
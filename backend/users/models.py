@@ -9,6 +9,16 @@ class User(AbstractUser):
         max_length=254,
         unique=True,
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов',
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков',
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -32,6 +42,11 @@ class Subscribe(models.Model):
         related_name='subscriber',
         verbose_name='Подписчик',
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата подписки',
+    )
 
     def __str__(self):
         return f'{self.user.username}, {self.author.username}'